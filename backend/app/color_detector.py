@@ -1,7 +1,10 @@
+import os
 import cv2
 import numpy as np
 import logging
-from typing import List, Dict, Tuple, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Tuple, Optional, NamedTuple
 
 from .models import HSVRange, ColorMarkerConfig, DetectedPoint
 
@@ -63,8 +66,34 @@ ZERO_KP = {'x': 0, 'y': 0, 'confidence': 0}
 
 # Minimum contour area to consider as a valid marker
 MIN_MARKER_AREA = 100
+# Minimum fraction of its bounding box a marker blob must fill (a disc fills ~0.79)
+MIN_FILL_RATIO = 0.4
 # Scale factor for confidence based on contour area
 CONFIDENCE_AREA_SCALE = 5000
+# Margin (px) around last known marker positions for the tracked search window
+ROI_MARGIN = 80
+# Frames with tracked markers missing before falling back to a downsampled full-frame search
+LOST_FRAMES_FALLBACK = 3
+# Frames a marker keeps its interpolated position (and its place in the search window)
+MAX_MISSING_FRAMES = 5
+# Colors classified per pass: one bit per color in a uint8 label image
+COLORS_PER_BANK = 8
+# Run HSV conversion and classification through OpenCV's OpenCL T-API (opt-in)
+USE_OPENCL = os.getenv('COLOR_MARKER_OPENCL', '0') == '1' and cv2.ocl.haveOpenCL()
+if USE_OPENCL:
+    cv2.ocl.setUseOpenCL(True)
+    logger.info("Color marker classification using OpenCL")
+
+
+class MarkerTables(NamedTuple):
+    """Per-frame lookup state compiled from marker configs.
+
+    Replaced as a whole on config updates, so a detection running on another
+    thread always sees one consistent set.
+    """
+    color_groups: Dict[str, List[ColorMarkerConfig]]  # color_name -> configs by position_order
+    luts: List[Tuple[np.ndarray, np.ndarray, np.ndarray]]  # per-bank H, S, V bit tables
+    color_bits: Dict[str, Tuple[int, int]]  # color_name -> (bank, bit)
 
 
 class ColorMarkerDetector:
@@ -75,117 +104,274 @@ class ColorMarkerDetector:
         self.label_mapping: Dict[str, str] = {}  # color_name -> joint_name
         self._prev_positions: Dict[str, Dict] = {}  # joint_name -> last known position
         self._missing_frames: Dict[str, int] = {}  # joint_name -> frames since last seen
-        self._kernel = np.ones((5, 5), np.uint8)
+        self._lost_frames = LOST_FRAMES_FALLBACK  # frames since all tracked markers were last found
+        self._local = threading.local()  # per-thread reusable image buffers
+        self._compile_configs()
 
     def update_configs(self, configs: List[ColorMarkerConfig]):
         """Update marker configurations (e.g., after HSV tuning)."""
         self.marker_configs = configs
+        self._compile_configs()
+
+    def _compile_configs(self):
+        """Precompute everything the per-frame path needs from marker_configs.
+
+        Configs are grouped by color and sorted by position_order once here. Each
+        unique color gets one bit in a uint8 bank (8 colors per bank) of per-channel
+        lookup tables: a pixel belongs to a color when the bit is set in the H, S and
+        V tables alike, so a single classification pass replaces one inRange per color.
+        """
+        # Group configs by color_name to know how many contours to find per color
+        color_groups: Dict[str, List[ColorMarkerConfig]] = {}
+        for config in self.marker_configs:
+            color_groups.setdefault(config.color_name, []).append(config)
+
+        # Sort each group by position_order
+        for group in color_groups.values():
+            group.sort(key=lambda c: c.position_order)
+
+        color_names = list(color_groups)
+        num_banks = (len(color_names) + COLORS_PER_BANK - 1) // COLORS_PER_BANK
+        luts = [tuple(np.zeros(256, np.uint8) for _ in range(3)) for _ in range(num_banks)]
+        color_bits: Dict[str, Tuple[int, int]] = {}
+
+        for i, color_name in enumerate(color_names):
+            bank, bit = divmod(i, COLORS_PER_BANK)
+            bit = 1 << bit
+            # The first config listed for a color defines its range
+            hsv_range = next(c.hsv_range for c in self.marker_configs if c.color_name == color_name)
+            lut_h, lut_s, lut_v = luts[bank]
+
+            if hsv_range.hue_low > hsv_range.hue_high:
+                # Red wraps around 0/180 in HSV
+                lut_h[:hsv_range.hue_high + 1] |= bit
+                lut_h[hsv_range.hue_low:180] |= bit
+            else:
+                lut_h[hsv_range.hue_low:hsv_range.hue_high + 1] |= bit
+            lut_s[hsv_range.sat_low:hsv_range.sat_high + 1] |= bit
+            lut_v[hsv_range.val_low:hsv_range.val_high + 1] |= bit
+
+            color_bits[color_name] = (bank, bit)
+
+        self._tables = MarkerTables(color_groups, luts, color_bits)
 
     def set_label_mapping(self, mapping: Dict[str, str]):
         """Set confirmed label mapping from calibration (color_name -> joint_name)."""
         self.label_mapping = mapping
 
-    def _create_mask(self, hsv: np.ndarray, hsv_range: HSVRange) -> np.ndarray:
-        """Create HSV mask, handling red hue wrapping."""
-        lower = np.array([hsv_range.hue_low, hsv_range.sat_low, hsv_range.val_low])
-        upper = np.array([hsv_range.hue_high, hsv_range.sat_high, hsv_range.val_high])
-
-        if hsv_range.hue_low > hsv_range.hue_high:
-            # Red wraps around 0/180 in HSV
-            mask1 = cv2.inRange(hsv, np.array([0, hsv_range.sat_low, hsv_range.val_low]),
-                                np.array([hsv_range.hue_high, hsv_range.sat_high, hsv_range.val_high]))
-            mask2 = cv2.inRange(hsv, np.array([hsv_range.hue_low, hsv_range.sat_low, hsv_range.val_low]),
-                                np.array([179, hsv_range.sat_high, hsv_range.val_high]))
-            mask = mask1 | mask2
-        else:
-            mask = cv2.inRange(hsv, lower, upper)
+    def _buffer(self, name: str, shape: Tuple[int, ...]) -> np.ndarray:
+        """Per-thread reusable uint8 buffer viewed at shape, grown when a larger one is needed.
+
+        Frames and search windows change size, so buffers keep their largest extent and
+        hand out views; OpenCV writes into those views in place via dst=.
+        """
+        buf = getattr(self._local, name, None)
+        if buf is None or any(have < need for have, need in zip(buf.shape, shape)):
+            grown = shape if buf is None else tuple(max(have, need) for have, need in zip(buf.shape, shape))
+            buf = np.empty(grown, np.uint8)
+            setattr(self._local, name, buf)
+        return buf[tuple(slice(0, n) for n in shape)]
+
+    def _to_hsv(self, frame: np.ndarray) -> np.ndarray:
+        """Convert frame to HSV into a reused buffer."""
+        hsv = self._buffer('hsv', frame.shape)
+        cv2.cvtColor(frame, cv2.COLOR_BGR2HSV, dst=hsv)
+        return hsv
 
-        # Morphological cleanup to reduce noise
-        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, self._kernel)
-        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, self._kernel)
+    def _classify(self, hsv: np.ndarray, luts: List[Tuple[np.ndarray, ...]]) -> List[np.ndarray]:
+        """Label every pixel with the color bits it matches, one uint8 image per bank."""
+        rows, cols = hsv.shape[:2]
+        planes = self._buffer('planes', (3, rows, cols))
+        h, s, v = cv2.split(hsv, [planes[0], planes[1], planes[2]])
+        tmp = self._buffer('lut_tmp', (rows, cols))
+        bank_buf = self._buffer('banks', (len(luts), rows, cols))
+
+        banks = []
+        for (lut_h, lut_s, lut_v), bits in zip(luts, bank_buf):
+            cv2.LUT(h, lut_h, dst=bits)
+            cv2.bitwise_and(bits, cv2.LUT(s, lut_s, dst=tmp), dst=bits)
+            cv2.bitwise_and(bits, cv2.LUT(v, lut_v, dst=tmp), dst=bits)
+            banks.append(bits)
+        return banks
+
+    def _classify_opencl(self, frame: np.ndarray, luts: List[Tuple[np.ndarray, ...]]) -> List[np.ndarray]:
+        """_classify on the OpenCL device: upload the frame, download only the banks."""
+        h, s, v = cv2.split(cv2.cvtColor(cv2.UMat(np.ascontiguousarray(frame)), cv2.COLOR_BGR2HSV))
+        banks = []
+        for lut_h, lut_s, lut_v in luts:
+            bits = cv2.bitwise_and(cv2.LUT(h, lut_h), cv2.LUT(s, lut_s))
+            banks.append(cv2.bitwise_and(bits, cv2.LUT(v, lut_v)).get())
+        return banks
+
+    def _create_mask(self, banks: List[np.ndarray], bank: int, bit: int) -> np.ndarray:
+        """Extract a single color's mask from the classified banks.
+
+        The result is written into a reused per-thread buffer and is only valid until
+        the next call on the same thread.
+        """
+        mask = self._buffer('mask', banks[bank].shape)
+        # No morphological cleanup: noise is rejected by blob area and fill ratio instead
+        np.bitwise_and(banks[bank], bit, out=mask)
         return mask
 
-    def detect_all_colors(self, frame: np.ndarray) -> List[Dict]:
+    def detect_all_colors(self, frame: np.ndarray,
+                          roi: Optional[Tuple[int, int, int, int]] = None) -> List[Dict]:
         """Calibration mode: detect all colored regions, return as list of dicts.
 
         Supports multiple markers of the same color - finds all valid contours
         per color, sorts by y-coordinate (top to bottom), and maps by position_order.
+        If roi (x0, y0, x1, y1) is given only that window is searched; coordinates
+        are still returned in full-frame space.
+        """
+        if roi is None:
+            return self._find_markers(frame)
+        x0, y0, x1, y1 = roi
+        return self._find_markers(frame[y0:y1, x0:x1], offset=(x0, y0))
+
+    def _find_markers(self, frame: np.ndarray, offset: Tuple[int, int] = (0, 0), scale: int = 1,
+                      cut: Optional[List[Tuple[int, int, int, int]]] = None,
+                      interior: Tuple[bool, bool, bool, bool] = (False, False, False, False)) -> List[Dict]:
+        """Detect markers in frame, mapping results back by offset and scale.
+
+        interior flags which (left, top, right, bottom) edges of frame lie inside the
+        full frame. Blobs touching those edges may be clipped, so they are left out and
+        their full-frame bounding boxes appended to cut instead.
         """
-        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+        tables = self._tables
+        min_area = MIN_MARKER_AREA / (scale * scale)
+        if USE_OPENCL:
+            banks = self._classify_opencl(frame, tables.luts)
+        else:
+            banks = self._classify(self._to_hsv(frame), tables.luts)
+
+        # Colors are independent: process them in parallel (OpenCV releases the GIL)
+        futures = [
+            _get_pool().submit(self._process_color, banks, tables.color_bits[color_name], group,
+                               offset, scale, min_area, cut, interior)
+            for color_name, group in tables.color_groups.items()
+        ]
         detected = []
+        for future in futures:
+            detected.extend(future.result())
+        return detected
 
-        # Group configs by color_name to know how many contours to find per color
-        color_groups: Dict[str, List] = {}
-        for config in self.marker_configs:
-            if config.color_name not in color_groups:
-                color_groups[config.color_name] = []
-            color_groups[config.color_name].append(config)
+    def _process_color(self, banks: List[np.ndarray], bank_bit: Tuple[int, int], group: List[ColorMarkerConfig],
+                       offset: Tuple[int, int], scale: int, min_area: float,
+                       cut: Optional[List[Tuple[int, int, int, int]]] = None,
+                       interior: Tuple[bool, bool, bool, bool] = (False, False, False, False)) -> List[Dict]:
+        """Mask one color and map its blobs to the color's configs by position_order."""
+        mask = self._create_mask(banks, *bank_bit)
+        # Area and centroid of every connected blob in one raster scan
+        _, _, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity=8, ltype=cv2.CV_32S)
 
-        # Sort each group by position_order
-        for color_name in color_groups:
-            color_groups[color_name].sort(key=lambda c: c.position_order)
+        # Keep compact blobs large enough to be markers (label 0 is background);
+        # sparse noise and thin streaks fill little of their bounding box
+        areas = stats[1:, cv2.CC_STAT_AREA]
+        box_areas = stats[1:, cv2.CC_STAT_WIDTH] * stats[1:, cv2.CC_STAT_HEIGHT]
+        labels = np.flatnonzero((areas > min_area) & (areas >= MIN_FILL_RATIO * box_areas)) + 1
 
-        # Process each unique color
-        processed_colors = set()
-        for config in self.marker_configs:
-            if config.color_name in processed_colors:
-                continue
-            processed_colors.add(config.color_name)
-
-            group = color_groups[config.color_name]
-            needed_count = len(group)
-
-            mask = self._create_mask(hsv, config.hsv_range)
-            contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-            # Find all valid contours for this color
-            valid_contours = []
-            for cnt in contours:
-                area = cv2.contourArea(cnt)
-                if area > MIN_MARKER_AREA:
-                    M = cv2.moments(cnt)
-                    if M["m00"] > 0:
-                        cx = M["m10"] / M["m00"]
-                        cy = M["m01"] / M["m00"]
-                        valid_contours.append({
-                            'cx': float(cx),
-                            'cy': float(cy),
-                            'area': area,
-                        })
-
-            # Sort by y-coordinate (top to bottom)
-            valid_contours.sort(key=lambda c: c['cy'])
-
-            # Map top N contours to configs by position_order
-            for i, cfg in enumerate(group):
-                if i < len(valid_contours):
-                    vc = valid_contours[i]
-                    detected.append({
-                        'id': f"{cfg.color_name}_{cfg.position_order}",
-                        'x': vc['cx'],
-                        'y': vc['cy'],
-                        'suggested_label': cfg.joint_name,
-                        'color_name': cfg.color_name,
-                        'display_color': cfg.display_color,
-                        'confidence': min(1.0, vc['area'] / CONFIDENCE_AREA_SCALE),
-                        'position_order': cfg.position_order,
-                    })
+        if cut is not None and any(interior):
+            # Blobs cut off by the search window would report a biased centroid
+            x, y = stats[labels, cv2.CC_STAT_LEFT], stats[labels, cv2.CC_STAT_TOP]
+            w, h = stats[labels, cv2.CC_STAT_WIDTH], stats[labels, cv2.CC_STAT_HEIGHT]
+            rows, cols = mask.shape
+            left, top, right, bottom = interior
+            clipped = ((left & (x == 0)) | (top & (y == 0))
+                       | (right & (x + w == cols)) | (bottom & (y + h == rows)))
+            for bx, by, bw, bh in zip(x[clipped], y[clipped], w[clipped], h[clipped]):
+                cut.append((int(bx * scale + offset[0]), int(by * scale + offset[1]),
+                            int((bx + bw) * scale + offset[0]), int((by + bh) * scale + offset[1])))
+            labels = labels[~clipped]
+
+        # Sort by y-coordinate (top to bottom)
+        labels = labels[np.argsort(centroids[labels, 1], kind='stable')]
+
+        # Map top N blobs to configs by position_order
+        detected = []
+        for cfg, label in zip(group, labels):
+            cx, cy = centroids[label]
+            area = stats[label, cv2.CC_STAT_AREA] * scale * scale
+            detected.append({
+                'id': f"{cfg.color_name}_{cfg.position_order}",
+                'x': float(cx * scale + offset[0]),
+                'y': float(cy * scale + offset[1]),
+                'suggested_label': cfg.joint_name,
+                'color_name': cfg.color_name,
+                'display_color': cfg.display_color,
+                'confidence': min(1.0, float(area) / CONFIDENCE_AREA_SCALE),
+                'position_order': cfg.position_order,
+            })
 
         return detected
 
+    def _bounding_roi(self, points: List[Dict], shape: Tuple) -> Tuple[int, int, int, int]:
+        """Union bounding box of points expanded by ROI_MARGIN, clipped to the frame."""
+        h, w = shape[:2]
+        xs = [p['x'] for p in points]
+        ys = [p['y'] for p in points]
+        return (max(0, int(min(xs)) - ROI_MARGIN), max(0, int(min(ys)) - ROI_MARGIN),
+                min(w, int(max(xs)) + ROI_MARGIN + 1), min(h, int(max(ys)) + ROI_MARGIN + 1))
+
+    def _search_window(self, frame: np.ndarray, roi: Tuple[int, int, int, int]) -> List[Dict]:
+        """Search a window of the frame, widening it until no marker is cut by its edges."""
+        h, w = frame.shape[:2]
+        while True:
+            x0, y0, x1, y1 = roi
+            cut: List[Tuple[int, int, int, int]] = []
+            points = self._find_markers(frame[y0:y1, x0:x1], offset=(x0, y0), cut=cut,
+                                        interior=(x0 > 0, y0 > 0, x1 < w, y1 < h))
+            if not cut:
+                return points
+            # Grow the window around the clipped blobs and search again
+            roi = (max(0, min([x0] + [c[0] - ROI_MARGIN for c in cut])),
+                   max(0, min([y0] + [c[1] - ROI_MARGIN for c in cut])),
+                   min(w, max([x1] + [c[2] + ROI_MARGIN for c in cut])),
+                   min(h, max([y1] + [c[3] + ROI_MARGIN for c in cut])))
+
+    def _search(self, frame: np.ndarray) -> List[Dict]:
+        """Tracked search: scan only around recently seen markers, re-acquire when lost.
+
+        The window covers every marker still being interpolated (missing for fewer than
+        MAX_MISSING_FRAMES frames), so one that was hidden briefly is found again where
+        it reappears. While any configured marker is not tracked (never seen, or aged
+        out of the window), or once tracked markers have been missing for
+        LOST_FRAMES_FALLBACK frames, a half-resolution full-frame pass also runs and the
+        window is widened to the markers it locates.
+        """
+        tracked = {name: self._prev_positions[name] for name, missing in self._missing_frames.items()
+                   if missing < MAX_MISSING_FRAMES and name in self._prev_positions}
+        untracked = {self._joint_name({'color_name': cfg.color_name, 'position_order': cfg.position_order,
+                                       'suggested_label': cfg.joint_name})
+                     for cfg in self.marker_configs} - tracked.keys()
+
+        anchors = list(tracked.values())
+        if untracked or self._lost_frames >= LOST_FRAMES_FALLBACK:
+            anchors += self._find_markers(cv2.pyrDown(frame), scale=2)
+        points = self._search_window(frame, self._bounding_roi(anchors, frame.shape)) if anchors else []
+
+        if tracked.keys() - {self._joint_name(pt) for pt in points}:
+            self._lost_frames += 1
+        else:
+            self._lost_frames = 0
+        return points
+
+    def _joint_name(self, pt: Dict) -> str:
+        """Joint a detected point is reported as."""
+        # Use suggested_label directly (already mapped by position_order in detect_all_colors)
+        # Override with label_mapping if exists (for legacy single-color mode)
+        if not pt.get('position_order') and pt['color_name'] in self.label_mapping:
+            return self.label_mapping[pt['color_name']]
+        return pt['suggested_label']
+
     def detect(self, frame: np.ndarray) -> Tuple[Optional[Dict], float]:
         """Production mode: detect markers and return keypoints dict compatible with MetricsCalculator."""
-        points = self.detect_all_colors(frame)
+        points = self._search(frame)
         if not points:
             return None, 0.0
 
         keypoints = {}
         for pt in points:
-            # Use suggested_label directly (already mapped by position_order in detect_all_colors)
-            joint_name = pt['suggested_label']
-            # Override with label_mapping if exists (for legacy single-color mode)
-            if not pt.get('position_order') and pt['color_name'] in self.label_mapping:
-                joint_name = self.label_mapping[pt['color_name']]
+            joint_name = self._joint_name(pt)
             keypoints[joint_name] = {
                 'x': pt['x'],
                 'y': pt['y'],
@@ -199,7 +385,7 @@ class ColorMarkerDetector:
         for name in COLOR_MARKER_JOINTS:
             if name not in keypoints:
                 self._missing_frames[name] = self._missing_frames.get(name, 0) + 1
-                if name in self._prev_positions and self._missing_frames[name] < 5:
+                if name in self._prev_positions and self._missing_frames[name] < MAX_MISSING_FRAMES:
                     # Use previous position with decaying confidence
                     prev = self._prev_positions[name]
                     decay = max(0.1, 1.0 - self._missing_frames[name] * 0.2)
@@ -214,3 +400,19 @@ class ColorMarkerDetector:
         confidences = [kp['confidence'] for kp in keypoints.values() if kp['confidence'] > 0]
         avg_conf = float(np.mean(confidences)) if confidences else 0.0
         return keypoints, avg_conf
+
+
+# Shared worker pool for per-color mask processing across all detectors
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    """Get or create the shared color-processing thread pool."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1),
+                                           thread_name_prefix='color-marker')
+    return _pool
@@ -49,11 +49,12 @@ async def health_check():
     from .pose_detector import get_detector
 
     detector = get_detector()
-    model_loaded = detector.model is not None
+    model_loaded = detector.backend is not None
 
     return {
         "status": "healthy" if model_loaded else "degraded",
         "model_loaded": model_loaded,
+        "backend": detector.backend,
         "device": detector.device
     }
 
@@ -70,12 +71,13 @@ async def startup_event():
     """Initialize services on startup."""
     logger.info("Starting Dog Rehabilitation Analysis API...")
 
-    # Pre-load the pose detector model
+    # Pre-load and warm up the pose detector model
     from .pose_detector import get_detector
     detector = get_detector()
+    detector.warmup()
 
-    if detector.model is not None:
-        logger.info("Pose detection model loaded successfully")
+    if detector.backend is not None:
+        logger.info(f"Pose detection model loaded successfully ({detector.backend})")
     else:
         logger.warning("Running in demo mode without pose detection model")
 
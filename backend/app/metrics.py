@@ -1,88 +1,214 @@
 import math
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple, Union
 from collections import deque
 import numpy as np
 
+from .models import KEYPOINT_NAMES
+
+JOINT_IDX = {name: i for i, name in enumerate(KEYPOINT_NAMES)}
+L_HIP = JOINT_IDX['left_hip']
+R_HIP = JOINT_IDX['right_hip']
+
+# Joint angle at the middle point of each (p1, p2, p3) triplet
+ANGLE_TRIPLETS = [
+    ('left_shoulder', ('left_elbow', 'left_shoulder', 'left_hip')),
+    ('right_shoulder', ('right_elbow', 'right_shoulder', 'right_hip')),
+    ('left_hip', ('left_shoulder', 'left_hip', 'left_knee')),
+    ('right_hip', ('right_shoulder', 'right_hip', 'right_knee')),
+    ('left_elbow', ('left_shoulder', 'left_elbow', 'left_wrist')),
+    ('right_elbow', ('right_shoulder', 'right_elbow', 'right_wrist')),
+    ('left_knee', ('left_hip', 'left_knee', 'left_ankle')),
+    ('right_knee', ('right_hip', 'right_knee', 'right_ankle')),
+]
+ANGLE_NAMES = [name for name, _ in ANGLE_TRIPLETS]
+TRIPLETS = np.array([[JOINT_IDX[j] for j in joints] for _, joints in ANGLE_TRIPLETS], dtype=np.int32)
+# Color marker mode has no wrist/ankle markers: only shoulder and hip angles apply
+NUM_MARKER_ANGLES = 4
+
+
+def step_ends(ys: np.ndarray) -> np.ndarray:
+    """Indices where vertical movement reverses direction (end of a step)."""
+    moving_down = np.diff(ys) > 0
+    return np.flatnonzero(moving_down[1:] != moving_down[:-1]) + 2
+
+
+def count_steps(ys: np.ndarray) -> int:
+    """Count direction changes in a paw's vertical position track."""
+    return len(step_ends(ys))
+
+
+def mean_stride(xy: np.ndarray) -> float:
+    """Mean horizontal stride over an (N, 2) paw track, 0 if no stride passes the threshold."""
+    # Find step cycles (peaks in vertical movement); each step starts where the last ended
+    ends = step_ends(xy[:, 1])
+    starts = np.concatenate(([0], ends[:-1]))
+    strides = np.abs(xy[ends, 0] - xy[starts, 0])
+    strides = strides[strides > 10]  # Minimum stride threshold
+
+    if len(strides) == 0:
+        return 0.0
+
+    return float(strides.mean())
+
 
 class MetricsCalculator:
     """Calculate gait metrics from pose keypoints."""
 
     def __init__(self, history_size: int = 100):
         self.history_size = history_size
-        self.keypoint_history: deque = deque(maxlen=history_size)
-        self.timestamp_history: deque = deque(maxlen=history_size)
-
-    def add_frame(self, keypoints: Dict, timestamp: int):
+        # Ring buffer of (x, y, confidence) per joint, one row per frame
+        self._kp_buf = np.zeros((history_size, len(KEYPOINT_NAMES), 3), dtype=np.float64)
+        self._head = 0  # next row to write
+        self._count = 0  # valid rows
+        # Hip center per frame, parallel to _kp_buf, and whether both hips were confident
+        self._hip_buf = np.zeros((history_size, 2), dtype=np.float64)
+        self._hip_valid = np.zeros(history_size, dtype=bool)
+        self._ts_buf = np.zeros(history_size, dtype=np.int64)  # frame timestamps (ms)
+        self._reset_smoothness()
+
+    def _reset_smoothness(self):
+        """Clear the running velocity-change statistics used by calculate_smoothness."""
+        self._frame_seq = 0  # frames added since reset
+        self._velocities: deque = deque()  # (frame seq, hip velocity)
+        self._velocity_changes: deque = deque()  # (seq of earlier velocity, |change|)
+        # Welford running mean / sum of squared deviations of velocity changes
+        self._velchg_count = 0
+        self._velchg_mean = 0.0
+        self._velchg_m2 = 0.0
+
+    def add_frame(self, keypoints: Union[Dict, np.ndarray], timestamp: int):
         """Add a frame's keypoints to history."""
-        self.keypoint_history.append(keypoints)
-        self.timestamp_history.append(timestamp)
-
-    def calculate_angle(self, p1: Dict, p2: Dict, p3: Dict) -> float:
+        row = self.keypoints_to_array(keypoints)
+        hip = (row[L_HIP, :2] + row[R_HIP, :2]) / 2
+        hip_valid = row[L_HIP, 2] >= 0.3 and row[R_HIP, 2] >= 0.3
+        self._update_smoothness(hip, hip_valid, timestamp)
+
+        self._kp_buf[self._head] = row
+        self._hip_buf[self._head] = hip
+        self._hip_valid[self._head] = hip_valid
+        self._ts_buf[self._head] = timestamp
+        self._head = (self._head + 1) % self.history_size
+        self._count = min(self._count + 1, self.history_size)
+
+    def _update_smoothness(self, hip: np.ndarray, hip_valid: bool, timestamp: int):
+        """Incrementally track hip velocity changes as a frame enters the history.
+
+        Mirrors a full recompute over the history window: velocities come from
+        adjacent frames with confident hips, changes from consecutive velocities,
+        and samples that depended on the evicted frame are dropped.
         """
-        Calculate angle at p2 formed by p1-p2-p3.
-        Returns angle in degrees.
+        seq = self._frame_seq
+        self._frame_seq += 1
+
+        if self._count == self.history_size:
+            # The oldest frame is evicted, and with it the velocity that started there
+            first_kept = seq - self.history_size + 2
+            while self._velocities and self._velocities[0][0] < first_kept:
+                self._velocities.popleft()
+            while self._velocity_changes and self._velocity_changes[0][0] < first_kept:
+                self._remove_velocity_change(self._velocity_changes.popleft()[1])
+
+        if self._count == 0:
+            return
+
+        if not (hip_valid and self._hip_valid[self._head - 1]):
+            return
+        dt = (timestamp - int(self._ts_buf[self._head - 1])) / 1000.0
+        if dt <= 0:
+            return
+
+        velocity = math.hypot(*(hip - self._hip_buf[self._head - 1])) / dt
+
+        if self._velocities:
+            prev_seq, prev_velocity = self._velocities[-1]
+            change = abs(velocity - prev_velocity)
+            self._velocity_changes.append((prev_seq, change))
+            self._add_velocity_change(change)
+        self._velocities.append((seq, velocity))
+
+    def _add_velocity_change(self, x: float):
+        self._velchg_count += 1
+        delta = x - self._velchg_mean
+        self._velchg_mean += delta / self._velchg_count
+        self._velchg_m2 += delta * (x - self._velchg_mean)
+
+    def _remove_velocity_change(self, x: float):
+        if self._velchg_count <= 1:
+            self._velchg_count = 0
+            self._velchg_mean = 0.0
+            self._velchg_m2 = 0.0
+            return
+        old_mean = self._velchg_mean
+        self._velchg_count -= 1
+        self._velchg_mean = (old_mean * (self._velchg_count + 1) - x) / self._velchg_count
+        self._velchg_m2 = max(0.0, self._velchg_m2 - (x - old_mean) * (x - self._velchg_mean))
+
+    def _chronological(self, buf: np.ndarray) -> np.ndarray:
+        """Valid rows of a ring buffer parallel to _kp_buf, oldest first."""
+        if self._count < self.history_size:
+            return buf[:self._count]
+        return np.roll(buf, -self._head, axis=0)
+
+    def _time_span(self) -> int:
+        """Milliseconds between the oldest and newest frame in history."""
+        oldest = (self._head - self._count) % self.history_size
+        return int(self._ts_buf[self._head - 1] - self._ts_buf[oldest])
+
+    def _joint_history(self, name: str) -> np.ndarray:
+        """Chronological (frames, 3) history of one joint, oldest first."""
+        return self._chronological(self._kp_buf[:, JOINT_IDX[name]])
+
+    def keypoints_to_array(self, keypoints: Union[Dict, np.ndarray]) -> np.ndarray:
+        """Pack a keypoints dict into a (num_joints, 3) array of x, y, confidence.
+
+        Arrays already in that layout (from the pose detector) are returned as is.
         """
-        if p1['confidence'] < 0.3 or p2['confidence'] < 0.3 or p3['confidence'] < 0.3:
-            return 0.0
+        if isinstance(keypoints, np.ndarray):
+            return keypoints
+        zero = {'x': 0, 'y': 0, 'confidence': 0}
+        return np.array(
+            [(kp['x'], kp['y'], kp['confidence'])
+             for kp in (keypoints.get(name, zero) for name in KEYPOINT_NAMES)],
+            dtype=np.float64,
+        )
+
+    def calculate_angles(self, kp_arr: np.ndarray, triplets: np.ndarray = TRIPLETS) -> np.ndarray:
+        """
+        Calculate the angle at p2 formed by p1-p2-p3 for every (p1, p2, p3) triplet.
+        Returns angles in degrees; 0 where a point is low-confidence or degenerate.
+        """
+        p1 = kp_arr[triplets[:, 0]]
+        p2 = kp_arr[triplets[:, 1]]
+        p3 = kp_arr[triplets[:, 2]]
 
         # Vectors
-        v1 = (p1['x'] - p2['x'], p1['y'] - p2['y'])
-        v2 = (p3['x'] - p2['x'], p3['y'] - p2['y'])
+        v1 = p1[:, :2] - p2[:, :2]
+        v2 = p3[:, :2] - p2[:, :2]
 
-        # Dot product and magnitudes
-        dot = v1[0] * v2[0] + v1[1] * v2[1]
-        mag1 = math.sqrt(v1[0]**2 + v1[1]**2)
-        mag2 = math.sqrt(v2[0]**2 + v2[1]**2)
+        # Dot and cross products: angle = atan2(|v1 x v2|, v1 . v2), which needs no
+        # magnitudes and stays accurate near 0 and 180 degrees where acos does not
+        dot = (v1 * v2).sum(axis=1)
+        cross = np.abs(v1[:, 0] * v2[:, 1] - v1[:, 1] * v2[:, 0])
 
-        if mag1 == 0 or mag2 == 0:
-            return 0.0
+        confident = (p1[:, 2] >= 0.3) & (p2[:, 2] >= 0.3) & (p3[:, 2] >= 0.3)
+        valid = confident & ((v1 * v1).sum(axis=1) > 0) & ((v2 * v2).sum(axis=1) > 0)
 
-        # Angle in radians, then convert to degrees
-        cos_angle = max(-1, min(1, dot / (mag1 * mag2)))
-        angle = math.acos(cos_angle)
-
-        return math.degrees(angle)
+        return np.where(valid, np.degrees(np.arctan2(cross, dot)), 0.0)
 
     def calculate_joint_angles(self, keypoints: Dict, detection_mode: str = 'ai_pose') -> Dict[str, float]:
         """Calculate all joint angles from keypoints."""
-        Z = {'x': 0, 'y': 0, 'confidence': 0}
+        return self._joint_angles(self.keypoints_to_array(keypoints), detection_mode)
 
+    def _joint_angles(self, kp_arr: np.ndarray, detection_mode: str) -> Dict[str, float]:
+        """Calculate all joint angles from a packed keypoints array."""
         # Shoulder and hip angles work for both modes
-        angles = {
-            'left_shoulder': self.calculate_angle(
-                keypoints.get('left_elbow', Z), keypoints.get('left_shoulder', Z), keypoints.get('left_hip', Z)
-            ),
-            'right_shoulder': self.calculate_angle(
-                keypoints.get('right_elbow', Z), keypoints.get('right_shoulder', Z), keypoints.get('right_hip', Z)
-            ),
-            'left_hip': self.calculate_angle(
-                keypoints.get('left_shoulder', Z), keypoints.get('left_hip', Z), keypoints.get('left_knee', Z)
-            ),
-            'right_hip': self.calculate_angle(
-                keypoints.get('right_shoulder', Z), keypoints.get('right_hip', Z), keypoints.get('right_knee', Z)
-            ),
-        }
+        num_angles = NUM_MARKER_ANGLES if detection_mode == 'color_marker' else len(ANGLE_NAMES)
+        values = self.calculate_angles(kp_arr, TRIPLETS[:num_angles])
 
-        if detection_mode == 'color_marker':
+        angles = dict(zip(ANGLE_NAMES, values.tolist()))
+        for name in ANGLE_NAMES[num_angles:]:
             # Color marker mode: no wrist/ankle markers, so elbow/knee angles = 0
-            angles['left_elbow'] = 0.0
-            angles['right_elbow'] = 0.0
-            angles['left_knee'] = 0.0
-            angles['right_knee'] = 0.0
-        else:
-            angles['left_elbow'] = self.calculate_angle(
-                keypoints.get('left_shoulder', Z), keypoints.get('left_elbow', Z), keypoints.get('left_wrist', Z)
-            )
-            angles['right_elbow'] = self.calculate_angle(
-                keypoints.get('right_shoulder', Z), keypoints.get('right_elbow', Z), keypoints.get('right_wrist', Z)
-            )
-            angles['left_knee'] = self.calculate_angle(
-                keypoints.get('left_hip', Z), keypoints.get('left_knee', Z), keypoints.get('left_ankle', Z)
-            )
-            angles['right_knee'] = self.calculate_angle(
-                keypoints.get('right_hip', Z), keypoints.get('right_knee', Z), keypoints.get('right_ankle', Z)
-            )
-
+            angles[name] = 0.0
         return angles
 
     def calculate_distance(self, p1: Dict, p2: Dict) -> float:
@@ -91,120 +217,57 @@ class MetricsCalculator:
 
     def calculate_speed(self) -> float:
         """Calculate movement speed from keypoint history."""
-        if len(self.keypoint_history) < 2:
+        if self._count < 2:
             return 0.0
 
         # Use hip center as reference point
-        total_distance = 0.0
-        count = 0
-
-        for i in range(1, len(self.keypoint_history)):
-            prev_kp = self.keypoint_history[i - 1]
-            curr_kp = self.keypoint_history[i]
-
-            # Calculate hip center movement
-            prev_hip = self._get_hip_center(prev_kp)
-            curr_hip = self._get_hip_center(curr_kp)
+        hips, valid = self._hip_centers()
+        steps = np.sqrt((np.diff(hips, axis=0) ** 2).sum(axis=1))
+        moved = valid[1:] & valid[:-1]
 
-            if prev_hip and curr_hip:
-                distance = self.calculate_distance(prev_hip, curr_hip)
-                total_distance += distance
-                count += 1
-
-        if count == 0 or len(self.timestamp_history) < 2:
+        if not moved.any():
             return 0.0
 
+        total_distance = float(steps[moved].sum())
+
         # Calculate time elapsed (in seconds)
-        time_elapsed = (self.timestamp_history[-1] - self.timestamp_history[0]) / 1000.0
+        time_elapsed = self._time_span() / 1000.0
 
         if time_elapsed <= 0:
             return 0.0
 
         return total_distance / time_elapsed
 
-    def _get_hip_center(self, keypoints: Dict) -> Optional[Dict]:
-        """Get center point between hips."""
-        left_hip = keypoints.get('left_hip', {'x': 0, 'y': 0, 'confidence': 0})
-        right_hip = keypoints.get('right_hip', {'x': 0, 'y': 0, 'confidence': 0})
-
-        if left_hip['confidence'] < 0.3 or right_hip['confidence'] < 0.3:
-            return None
-
-        return {
-            'x': (left_hip['x'] + right_hip['x']) / 2,
-            'y': (left_hip['y'] + right_hip['y']) / 2,
-            'confidence': (left_hip['confidence'] + right_hip['confidence']) / 2
-        }
+    def _hip_centers(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Center point between hips per frame, and whether both hips were confident."""
+        return self._chronological(self._hip_buf), self._chronological(self._hip_valid)
 
     def calculate_stride_length(self, ref_key: str = 'left_front_paw') -> float:
         """Calculate average stride length from limb endpoint movements."""
-        if len(self.keypoint_history) < 10:
+        if self._count < 10:
             return 0.0
 
         # Track reference point movements
-        paw_positions = []
-        for kp in self.keypoint_history:
-            paw = kp.get(ref_key, {'x': 0, 'y': 0, 'confidence': 0})
-            if paw['confidence'] > 0.3:
-                paw_positions.append(paw)
+        paw = self._joint_history(ref_key)
+        paw_positions = paw[paw[:, 2] > 0.3]
 
         if len(paw_positions) < 2:
             return 0.0
 
-        # Find step cycles (peaks in vertical movement)
-        strides = []
-        prev_y = paw_positions[0]['y']
-        prev_x = paw_positions[0]['x']
-        direction = 0
-        step_start_x = prev_x
-
-        for pos in paw_positions[1:]:
-            curr_direction = 1 if pos['y'] > prev_y else -1
-
-            # Detected direction change (end of step)
-            if direction != 0 and curr_direction != direction:
-                stride = abs(pos['x'] - step_start_x)
-                if stride > 10:  # Minimum stride threshold
-                    strides.append(stride)
-                step_start_x = pos['x']
-
-            direction = curr_direction
-            prev_y = pos['y']
-            prev_x = pos['x']
-
-        if len(strides) == 0:
-            return 0.0
-
-        return sum(strides) / len(strides)
+        return mean_stride(paw_positions[:, :2])
 
     def calculate_cadence(self, ref_key: str = 'left_front_paw') -> float:
         """Calculate steps per minute."""
-        if len(self.keypoint_history) < 20:
+        if self._count < 20:
             return 0.0
 
         # Count direction changes in reference point vertical position
-        step_count = 0
-        prev_y = None
-        direction = 0
-
-        for kp in self.keypoint_history:
-            paw = kp.get(ref_key, {'y': 0, 'confidence': 0})
-            if paw['confidence'] < 0.3:
-                continue
-
-            if prev_y is not None:
-                curr_direction = 1 if paw['y'] > prev_y else -1
-                if direction != 0 and curr_direction != direction:
-                    step_count += 1
-                direction = curr_direction
-
-            prev_y = paw['y']
+        paw = self._joint_history(ref_key)
+        paw_y = paw[paw[:, 2] >= 0.3, 1]
+        step_count = count_steps(paw_y)
 
         # Calculate time in minutes
-        if len(self.timestamp_history) < 2:
-            return 0.0
-
-        time_minutes = (self.timestamp_history[-1] - self.timestamp_history[0]) / 60000.0
+        time_minutes = self._time_span() / 60000.0
 
         if time_minutes <= 0:
             return 0.0
@@ -240,34 +303,14 @@ class MetricsCalculator:
 
     def calculate_smoothness(self) -> float:
         """Calculate movement smoothness (0-1, 1 = very smooth)."""
-        if len(self.keypoint_history) < 4:
+        if self._count < 4:
             return 0.0
 
-        # Calculate velocity changes (jerk)
-        velocities = []
-
-        for i in range(1, len(self.keypoint_history)):
-            prev_hip = self._get_hip_center(self.keypoint_history[i - 1])
-            curr_hip = self._get_hip_center(self.keypoint_history[i])
-
-            if prev_hip and curr_hip:
-                dt = (self.timestamp_history[i] - self.timestamp_history[i - 1]) / 1000.0
-                if dt > 0:
-                    dx = curr_hip['x'] - prev_hip['x']
-                    dy = curr_hip['y'] - prev_hip['y']
-                    velocity = math.sqrt(dx**2 + dy**2) / dt
-                    velocities.append(velocity)
-
-        if len(velocities) < 2:
+        # Variance of velocity changes (jerk), maintained incrementally by add_frame
+        if len(self._velocities) < 2:
             return 0.0
 
-        # Calculate variance in velocity changes
-        velocity_changes = [abs(velocities[i] - velocities[i-1]) for i in range(1, len(velocities))]
-
-        if len(velocity_changes) == 0:
-            return 1.0
-
-        variance = np.var(velocity_changes)
+        variance = self._velchg_m2 / self._velchg_count
 
         # Normalize to 0-1 (lower variance = smoother)
         # Using exponential decay for normalization
@@ -275,13 +318,14 @@ class MetricsCalculator:
 
         return min(1.0, max(0.0, smoothness))
 
-    def calculate_gait_metrics(self, keypoints: Dict, timestamp: int, detection_mode: str = 'ai_pose') -> Dict:
+    def calculate_gait_metrics(self, keypoints: Union[Dict, np.ndarray], timestamp: int,
+                               detection_mode: str = 'ai_pose') -> Dict:
         """Calculate all gait metrics."""
         # Add to history
         self.add_frame(keypoints, timestamp)
 
         # Calculate joint angles
-        joint_angles = self.calculate_joint_angles(keypoints, detection_mode)
+        joint_angles = self._joint_angles(self._kp_buf[self._head - 1], detection_mode)
 
         # For color marker mode, use elbow as reference point instead of paw
         ref_key = 'left_elbow' if detection_mode == 'color_marker' else 'left_front_paw'
@@ -302,5 +346,6 @@ class MetricsCalculator:
 
     def reset(self):
         """Reset history for new session."""
-        self.keypoint_history.clear()
-        self.timestamp_history.clear()
+        self._head = 0
+        self._count = 0
+        self._reset_smoothness()
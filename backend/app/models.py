@@ -1,8 +1,45 @@
+import struct
+from dataclasses import dataclass
+import numpy as np
 from pydantic import BaseModel
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Union
 from datetime import datetime
 from enum import Enum
 
+# Dog keypoint names (24 keypoints), in DogKeypoints field order
+KEYPOINT_NAMES = [
+    'nose', 'left_eye', 'right_eye', 'left_ear', 'right_ear',
+    'left_shoulder', 'right_shoulder', 'left_elbow', 'right_elbow',
+    'left_wrist', 'right_wrist', 'left_hip', 'right_hip',
+    'left_knee', 'right_knee', 'left_ankle', 'right_ankle',
+    'tail_base', 'tail_mid', 'tail_tip',
+    'left_front_paw', 'right_front_paw', 'left_back_paw', 'right_back_paw'
+]
+
+def keypoints_to_dict(kp: np.ndarray, min_confidence: Optional[float] = None) -> Dict[str, Dict[str, float]]:
+    """Expand a (24, 3) x, y, confidence array into the keypoint-name dict sent to clients.
+
+    With min_confidence, only keypoints above it are included; the rest are
+    filtered on the array, so no dicts are built for them.
+    """
+    rows = range(len(kp)) if min_confidence is None else np.flatnonzero(kp[:, 2] > min_confidence).tolist()
+    return {
+        KEYPOINT_NAMES[i]: {'x': x, 'y': y, 'confidence': c}
+        for i, (x, y, c) in zip(rows, kp[rows].tolist())
+    }
+
+
+# Binary frame message header: kind (index into BINARY_FRAME_TYPES), 7 pad bytes,
+# float64 timestamp (ms); the encoded image follows
+FRAME_HEADER = struct.Struct('<B7xd')
+BINARY_FRAME_TYPES = ('frame', 'calibrate_frame')
+
+# Binary pose result header: tag byte RESULT_TAG, 7 pad bytes, float64 timestamp (ms),
+# float32 confidence, 4 pad bytes; then 24 x (x, y, confidence) float32 keypoints in
+# KEYPOINT_NAMES order, then UTF-8 JSON {joint_angles, gait_metrics}
+RESULT_HEADER = struct.Struct('<B7xdf4x')
+RESULT_TAG = ord('K')
+
 
 class Keypoint(BaseModel):
     x: float
@@ -70,11 +107,40 @@ class WebSocketMessage(BaseModel):
     timestamp: Optional[int] = None
 
 
-class FrameData(BaseModel):
+@dataclass(slots=True)
+class FrameData:
+    """Inbound frame message.
+
+    A plain dataclass rather than a BaseModel: frames arrive at camera rate, so
+    the few fields are checked by hand instead of running Pydantic validation.
+    """
     type: str
-    data: str  # base64 encoded image
+    data: Union[str, memoryview]  # base64 encoded image (text) or raw image bytes (binary)
     timestamp: int
 
+    @classmethod
+    def from_message(cls, message: dict) -> 'FrameData':
+        """Build from a decoded WebSocket message, raising ValueError on bad fields."""
+        data = message.get('data', '')
+        timestamp = message.get('timestamp', 0)
+        if not isinstance(data, str):
+            raise ValueError('Frame data must be a base64 string')
+        if not isinstance(timestamp, (int, float)) or isinstance(timestamp, bool):
+            raise ValueError('Frame timestamp must be a number')
+        return cls(type=message.get('type', ''), data=data, timestamp=int(timestamp))
+
+    @classmethod
+    def from_binary(cls, payload: bytes) -> 'FrameData':
+        """Build from a binary WebSocket message (FRAME_HEADER + image), raising ValueError."""
+        if len(payload) <= FRAME_HEADER.size:
+            raise ValueError('Binary frame too short')
+        kind, timestamp = FRAME_HEADER.unpack_from(payload)
+        if kind >= len(BINARY_FRAME_TYPES):
+            raise ValueError(f'Unknown binary frame kind {kind}')
+        # A view, so the image bytes are not copied out of the message
+        data = memoryview(payload)[FRAME_HEADER.size:]
+        return cls(type=BINARY_FRAME_TYPES[kind], data=data, timestamp=int(timestamp))
+
 
 class DetectionMode(str, Enum):
     AI_POSE = "ai_pose"
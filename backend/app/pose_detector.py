@@ -1,26 +1,208 @@
+import os
+import glob
 import base64
 import numpy as np
 import cv2
-from io import BytesIO
-from PIL import Image
-from typing import Optional, Dict, Tuple
+from typing import Optional, List, Tuple, Union
 import logging
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
 import torch
 
-# Fix for PyTorch 2.6+ weights_only default change
-torch.serialization.add_safe_globals([])
+from .models import KEYPOINT_NAMES
 
 logger = logging.getLogger(__name__)
 
-# YOLO Dog Pose keypoint names (24 keypoints)
-KEYPOINT_NAMES = [
+# libjpeg-turbo SIMD decoder for JPEG frames, if the native library is available
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR
+    _turbo_jpeg = TurboJPEG()
+except Exception as e:
+    logger.info(f"TurboJPEG unavailable, decoding frames with OpenCV: {e}")
+    _turbo_jpeg = None
+
+JPEG_MAGIC = b'\xff\xd8'
+
+# Inference backend: 'onnx' (ONNX Runtime, falls back to ultralytics), 'torchscript'
+# (traced ultralytics network) or 'ultralytics'
+POSE_BACKEND = os.getenv('POSE_BACKEND', 'onnx')
+# Network input size (square, letterboxed)
+INPUT_SIZE = 640
+# Minimum detection score for a pose to be reported (Ultralytics predict default)
+DETECTION_THRESHOLD = 0.25
+# Keypoints below this confidence have their coordinates zeroed, as Ultralytics does
+KEYPOINT_VISIBLE = 0.5
+# ONNX model precision: 'fp32', or 'int8' (statically quantized from calibration frames)
+POSE_PRECISION = os.getenv('POSE_PRECISION', 'fp32')
+# Directory of representative frames (jpg/png) used to calibrate INT8 activation ranges
+POSE_CALIBRATION_DIR = os.getenv('POSE_CALIBRATION_DIR', '')
+MAX_CALIBRATION_FRAMES = 500
+# Compile the eager ultralytics network with torch.compile (opt-in: slow first start)
+POSE_COMPILE = os.getenv('POSE_COMPILE', '0') == '1'
+# Torch device for the ultralytics backend ('cpu', 'cuda', 'cuda:1', ...)
+POSE_DEVICE = os.getenv('POSE_DEVICE', 'cpu')
+# On CUDA, replay the ultralytics network's forward pass from a captured CUDA graph
+POSE_CUDA_GRAPH = os.getenv('POSE_CUDA_GRAPH', '1') == '1'
+
+
+# Keypoints output by the standard YOLO pose model, in model output order
+YOLO_KEYPOINTS = [
     'nose', 'left_eye', 'right_eye', 'left_ear', 'right_ear',
     'left_shoulder', 'right_shoulder', 'left_elbow', 'right_elbow',
     'left_wrist', 'right_wrist', 'left_hip', 'right_hip',
-    'left_knee', 'right_knee', 'left_ankle', 'right_ankle',
-    'tail_base', 'tail_mid', 'tail_tip',
-    'left_front_paw', 'right_front_paw', 'left_back_paw', 'right_back_paw'
+    'left_knee', 'right_knee', 'left_ankle', 'right_ankle'
 ]
+_KP = {name: i for i, name in enumerate(KEYPOINT_NAMES)}
+# Row in our keypoint array for each YOLO output keypoint
+YOLO_TO_KEYPOINT = np.array([_KP[name] for name in YOLO_KEYPOINTS], dtype=np.intp)
+# Tail and paws are estimated from the YOLO keypoints
+L_HIP, R_HIP = _KP['left_hip'], _KP['right_hip']
+TAIL = [_KP['tail_base'], _KP['tail_mid'], _KP['tail_tip']]
+TAIL_OFFSETS = np.array([[0, 0], [-30, -10], [-60, -20]], dtype=np.float64)
+TAIL_CONFIDENCE = np.array([0.5, 0.4, 0.3], dtype=np.float64)
+PAWS = [_KP['left_front_paw'], _KP['right_front_paw'], _KP['left_back_paw'], _KP['right_back_paw']]
+PAW_SOURCES = [_KP['left_wrist'], _KP['right_wrist'], _KP['left_ankle'], _KP['right_ankle']]
+PAW_OFFSET = 15
+
+# Demo mode: per-keypoint (x offset, y offset, confidence) ranges around the frame center
+DEMO_LOW = np.array([-100.0, -50.0, 0.6])
+DEMO_HIGH = np.array([100.0, 50.0, 0.95])
+_demo_rng = np.random.default_rng()
+
+
+@lru_cache(maxsize=16)
+def _letterbox_geometry(h: int, w: int, size: int) -> Tuple[float, int, int, int, int]:
+    """Resize scale, resized (w, h) and (left, top) padding for a frame size."""
+    scale = min(size / h, size / w)
+    new_w, new_h = round(w * scale), round(h * scale)
+    dw, dh = (size - new_w) / 2, (size - new_h) / 2
+    return scale, new_w, new_h, round(dw - 0.1), round(dh - 0.1)
+
+
+# Per-thread letterbox canvas, reused across frames of the same size
+_local = threading.local()
+
+
+def letterbox(frame: np.ndarray, size: int = INPUT_SIZE) -> Tuple[np.ndarray, float, Tuple[int, int]]:
+    """Resize keeping aspect ratio and pad to size x size with gray, as Ultralytics does.
+
+    Returns the padded image, the resize scale and the (left, top) padding. The image
+    is a per-thread buffer, valid until the next call on the same thread: the gray
+    border is only painted when the frame size changes, and the frame is resized
+    straight into the middle of it.
+    """
+    h, w = frame.shape[:2]
+    scale, new_w, new_h, left, top = _letterbox_geometry(h, w, size)
+
+    if getattr(_local, 'geometry', None) != (h, w, size):
+        _local.canvas = np.full((size, size, 3), 114, dtype=np.uint8)
+        _local.geometry = (h, w, size)
+    padded = _local.canvas
+
+    content = padded[top:top + new_h, left:left + new_w]
+    if (new_w, new_h) != (w, h):
+        cv2.resize(frame, (new_w, new_h), dst=content, interpolation=cv2.INTER_LINEAR)
+    else:
+        content[...] = frame
+    return padded, scale, (left, top)
+
+
+def preprocess(frame: np.ndarray, out: Optional[np.ndarray] = None) -> Tuple[np.ndarray, float, Tuple[int, int]]:
+    """Letterbox a BGR frame into a (1, 3, H, W) RGB float32 blob in [0, 1].
+
+    If out is given the blob is written into it (e.g. a pinned host buffer).
+    """
+    padded, scale, pad = letterbox(frame)
+    chw = padded[:, :, ::-1].transpose(2, 0, 1)[None]
+    if out is None:
+        return np.ascontiguousarray(chw, dtype=np.float32) / 255.0, scale, pad
+    np.divide(chw, np.float32(255.0), out=out, dtype=np.float32)
+    return out, scale, pad
+
+
+def quantize_int8(fp32_path: str, calibration_dir: str) -> Optional[str]:
+    """Statically quantize an ONNX pose model to INT8 (QDQ, per-channel weights).
+
+    Activation ranges are calibrated on frames from calibration_dir. The result is
+    written next to the FP32 model and reused on later starts. Returns its path, or
+    None if it could not be built.
+    """
+    int8_path = os.path.splitext(fp32_path)[0] + '.int8.onnx'
+    if os.path.exists(int8_path):
+        return int8_path
+
+    import onnx
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    paths = sorted(p for ext in ('jpg', 'jpeg', 'png') for p in glob.glob(os.path.join(calibration_dir, f'*.{ext}')))
+    paths = paths[:MAX_CALIBRATION_FRAMES]
+    if not paths:
+        logger.warning(f"No calibration frames in '{calibration_dir}', keeping FP32 pose model")
+        return None
+
+    input_name = onnx.load(fp32_path).graph.input[0].name
+
+    class FrameReader(CalibrationDataReader):
+        def __init__(self):
+            self._paths = iter(paths)
+
+        def get_next(self):
+            for path in self._paths:
+                frame = cv2.imread(path, cv2.IMREAD_COLOR)
+                if frame is not None:
+                    return {input_name: preprocess(frame)[0]}
+            return None
+
+    logger.info(f"Quantizing pose model to INT8 with {len(paths)} calibration frames")
+    quantize_static(fp32_path, int8_path, FrameReader(), quant_format=QuantFormat.QDQ,
+                    activation_type=QuantType.QInt8, weight_type=QuantType.QInt8, per_channel=True)
+    return int8_path
+
+
+_torch_load_lock = threading.Lock()
+
+
+@contextmanager
+def full_checkpoint_load():
+    """Let torch.load unpickle full ultralytics checkpoints inside this block.
+
+    PyTorch 2.6+ defaults to weights_only=True, which rejects the model classes
+    pickled into the .pt file. torch.load is swapped under a lock and always
+    restored, even if loading fails.
+    """
+    with _torch_load_lock:
+        original_load = torch.load
+
+        def load(*args, **kwargs):
+            kwargs['weights_only'] = False
+            return original_load(*args, **kwargs)
+
+        torch.load = load
+        try:
+            yield
+        finally:
+            torch.load = original_load
+
+
+def decode_pose_candidate(candidate: np.ndarray, scale: float, pad: Tuple[int, int],
+                          shape: Tuple) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """Decode a single (56,) YOLOv8-pose candidate, or None if its score is below threshold.
+
+    A candidate is [cx, cy, w, h, score, 17 x (x, y, conf)]. Returns (keypoints xy in
+    pixels of a frame of the given shape, keypoint confidences). Keypoints predicted in the letterbox padding are clipped to the frame, as
+    Ultralytics does when scaling coordinates back.
+    """
+    if candidate[4] < DETECTION_THRESHOLD:
+        return None
+
+    kpts = candidate[5:].reshape(-1, 3)
+    xy = (kpts[:, :2] - pad) / scale
+    h, w = shape[:2]
+    np.clip(xy, 0, (w, h), out=xy)
+    conf = kpts[:, 2]
+    xy[conf < KEYPOINT_VISIBLE] = 0
+    return xy, conf
 
 
 class PoseDetector:
@@ -33,198 +215,405 @@ class PoseDetector:
         """
         self.device = device
         self.model = None
+        self.session = None
+        self._net = None  # fused torch network, run without the ultralytics predictor
+        self._graph = None
+        # Reusable input buffers; detection only ever runs on the inference thread
+        self._blob: Optional[np.ndarray] = None
+        self._host: Optional[torch.Tensor] = None
         self.model_path = model_path
-        self._load_model()
+        if POSE_BACKEND == 'onnx':
+            self._load_onnx()
+        if self.session is None and self.model is None:
+            self._load_model()
+            if self.model is not None:
+                self._prepare_net()
+            if self._net is not None and POSE_BACKEND == 'torchscript':
+                self._trace_model()
+            if self._net is not None and POSE_COMPILE and POSE_BACKEND != 'torchscript':
+                self._compile_model()
+            elif self._net is not None and POSE_CUDA_GRAPH and self.device.startswith('cuda'):
+                self._capture_cuda_graph()
+
+    @property
+    def backend(self) -> Optional[str]:
+        """Name of the loaded inference backend, or None in demo mode."""
+        if self.session is not None:
+            return 'onnx'
+        if self.model is None:
+            return None
+        return 'torchscript' if isinstance(self._net, torch.jit.ScriptModule) else 'ultralytics'
+
+    def _load_onnx(self):
+        """Load the pose model into ONNX Runtime, exporting it from the .pt weights once."""
+        try:
+            import onnxruntime as ort
+
+            onnx_path = os.path.splitext(self.model_path)[0] + '.onnx'
+            if not os.path.exists(onnx_path):
+                self._load_model()
+                if self.model is None:
+                    return
+                # Dynamic axes so frames from several connections can share a batch
+                onnx_path = self.model.export(format='onnx', imgsz=INPUT_SIZE, dynamic=True, simplify=False)
+                self.model = None
+
+            if POSE_PRECISION == 'int8':
+                try:
+                    onnx_path = quantize_int8(onnx_path, POSE_CALIBRATION_DIR) or onnx_path
+                except Exception as e:
+                    logger.error(f"INT8 quantization failed, keeping FP32 pose model: {e}")
+
+            available = ort.get_available_providers()
+            providers = [p for p in ('CUDAExecutionProvider', 'CPUExecutionProvider') if p in available]
+            self.session = ort.InferenceSession(onnx_path, providers=providers)
+            model_input = self.session.get_inputs()[0]
+            self._input_name = model_input.name
+            self._dynamic_batch = not isinstance(model_input.shape[0], int)
+            logger.info(f"Loaded ONNX pose model {onnx_path} ({self.session.get_providers()[0]})")
+        except Exception as e:
+            logger.error(f"Failed to load ONNX pose model: {e}")
+            logger.info("Falling back to the ultralytics model")
+            self.session = None
 
     def _load_model(self):
         """Load YOLO pose model."""
         try:
-            # Fix for PyTorch 2.6+ - allow ultralytics model classes
-            import torch.serialization
-            original_load = torch.load
-
-            def patched_load(*args, **kwargs):
-                kwargs['weights_only'] = False
-                return original_load(*args, **kwargs)
-
-            torch.load = patched_load
-
             from ultralytics import YOLO
-            self.model = YOLO("yolov8n-pose.pt")
+            with full_checkpoint_load():
+                self.model = YOLO("yolov8n-pose.pt")
             logger.info("Loaded YOLOv8 pose model successfully")
 
-            # Restore original torch.load
-            torch.load = original_load
-
             self.model.to(self.device)
         except Exception as e:
             logger.error(f"Failed to load YOLO model: {e}")
             logger.info("Running in demo mode with simulated keypoints")
             self.model = None
 
-    def decode_frame(self, base64_data: str) -> Optional[np.ndarray]:
-        """Decode base64 image to numpy array."""
+    def _prepare_net(self):
+        """Pull the fused network out of the ultralytics wrapper.
+
+        Frames then go through our own letterbox into a reused input tensor and the
+        raw network, skipping the predictor's per-frame allocations and NMS.
+        """
+        try:
+            # The first predict builds the predictor and fuses conv+bn; pin it to our device,
+            # or ultralytics moves the network to cuda:0 whenever CUDA is available
+            self.model(np.zeros((INPUT_SIZE, INPUT_SIZE, 3), dtype=np.uint8), verbose=False, device=self.device)
+            self._net = self.model.predictor.model.model.eval()
+        except Exception as e:
+            logger.error(f"Failed to prepare pose network, using the ultralytics predictor: {e}")
+            self._net = None
+
+    def _input_tensor(self, batch: int) -> torch.Tensor:
+        """Reusable host input tensor for batch frames, page-locked on CUDA for async copies."""
+        if self._host is None or self._host.shape[0] < batch:
+            self._host = torch.empty((batch, 3, INPUT_SIZE, INPUT_SIZE), pin_memory=self.device.startswith('cuda'))
+        return self._host[:batch]
+
+    def _compile_model(self):
+        """Compile the fused network with torch.compile and warm it up.
+
+        Frames are always letterboxed to one size, so the graph is specialized
+        (dynamic=False) and reduce-overhead can replay it as a CUDA graph on GPU.
+        """
+        if self.device.startswith('cuda'):
+            torch.set_float32_matmul_precision('high')
+
+        eager = self._net
         try:
-            # Remove data URL prefix if present
-            if ',' in base64_data:
-                base64_data = base64_data.split(',')[1]
+            self._net = torch.compile(eager, mode='reduce-overhead', fullgraph=False, dynamic=False)
+
+            # Pay compilation here rather than on the first WebSocket frame
+            dummy = torch.zeros((1, 3, INPUT_SIZE, INPUT_SIZE), device=self.device)
+            with torch.no_grad():
+                for _ in range(2):
+                    self._net(dummy)
+            logger.info("Compiled pose model with torch.compile")
+        except Exception as e:
+            logger.error(f"torch.compile failed, running eager pose model: {e}")
+            self._net = eager
+
+    def _trace_model(self):
+        """Trace the fused network to TorchScript and optimize it for inference.
+
+        The traced module runs without Python dispatch between layers; frames still go
+        through the same letterbox and input tensor as the eager network.
+        """
+        eager = self._net
+        try:
+            dummy = torch.zeros((1, 3, INPUT_SIZE, INPUT_SIZE), device=self.device)
+            with torch.no_grad():
+                # The pose head returns a list of feature maps next to the predictions
+                traced = torch.jit.trace(eager, dummy, strict=False)
+                self._net = torch.jit.optimize_for_inference(traced)
+                # The profiling executor specializes the graph over the first runs
+                for _ in range(2):
+                    self._net(dummy)
+            logger.info("Traced pose model to TorchScript")
+        except Exception as e:
+            logger.error(f"TorchScript tracing failed, running eager pose model: {e}")
+            self._net = eager
+
+    def _capture_cuda_graph(self):
+        """Capture the fused network's forward pass on one letterboxed frame as a CUDA graph.
+
+        Every frame is letterboxed to the same INPUT_SIZE square, so the GPU work is
+        identical per frame; replaying the graph skips per-kernel launch overhead.
+        """
+        try:
+            net = self._net
+            static_in = torch.zeros((1, 3, INPUT_SIZE, INPUT_SIZE), device=self.device)
+            with torch.no_grad():
+                # Warm up on a side stream before capture, as CUDA graph capture requires
+                stream = torch.cuda.Stream()
+                stream.wait_stream(torch.cuda.current_stream())
+                with torch.cuda.stream(stream):
+                    for _ in range(3):
+                        net(static_in)
+                torch.cuda.current_stream().wait_stream(stream)
+
+                graph = torch.cuda.CUDAGraph()
+                with torch.cuda.graph(graph):
+                    static_out = net(static_in)
+
+            self._graph_in = static_in
+            # Eval-mode pose head returns (decoded predictions, raw features)
+            self._graph_out = static_out[0] if isinstance(static_out, (tuple, list)) else static_out
+            self._graph = graph
+            logger.info("Captured pose model forward pass as a CUDA graph")
+        except Exception as e:
+            logger.error(f"CUDA graph capture failed, running eager pose model: {e}")
+            self._graph = None
 
-            # Decode base64
-            image_bytes = base64.b64decode(base64_data)
+    def warmup(self):
+        """Run one dummy frame so the first client frame does not pay first-run setup."""
+        self.detect(np.zeros((INPUT_SIZE, INPUT_SIZE, 3), dtype=np.uint8))
 
-            # Convert to PIL Image
-            image = Image.open(BytesIO(image_bytes))
+    def decode_frame(self, frame_data: Union[str, bytes, memoryview]) -> Optional[np.ndarray]:
+        """Decode a base64 string or raw encoded image bytes to a BGR numpy array."""
+        try:
+            if isinstance(frame_data, str):
+                # Remove data URL prefix if present
+                if ',' in frame_data:
+                    frame_data = frame_data.split(',')[1]
+
+                # Decode base64
+                image_bytes = base64.b64decode(frame_data)
+            else:
+                image_bytes = frame_data
 
-            # Convert to numpy array (BGR for OpenCV)
-            frame = np.array(image)
-            if len(frame.shape) == 3 and frame.shape[2] == 4:
-                frame = cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR)
-            elif len(frame.shape) == 3 and frame.shape[2] == 3:
-                frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+            # JPEG fast path: decode straight to BGR
+            if _turbo_jpeg is not None and image_bytes[:2] == JPEG_MAGIC:
+                return _turbo_jpeg.decode(image_bytes, pixel_format=TJPF_BGR)
 
+            # Anything else (PNG, WebP, ...): OpenCV decodes straight to 3-channel BGR,
+            # dropping alpha
+            frame = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if frame is None:
+                raise ValueError('Unsupported or corrupt image data')
             return frame
         except Exception as e:
             logger.error(f"Failed to decode frame: {e}")
             return None
 
-    def detect(self, frame: np.ndarray) -> Tuple[Optional[Dict], float]:
+    def detect(self, frame: np.ndarray) -> Tuple[Optional[np.ndarray], float]:
         """
         Run pose detection on a frame.
 
         Returns:
-            Tuple of (keypoints dict, confidence score)
+            Tuple of ((24, 3) keypoints array, confidence score)
         """
+        return self.detect_batch([frame])[0]
+
+    def detect_batch(self, frames: List[np.ndarray]) -> List[Tuple[Optional[np.ndarray], float]]:
+        """Run pose detection on several frames in one forward pass, one result per frame."""
+        if self.session is not None:
+            return self._detect_onnx(frames)
+
+        if self._graph is not None:
+            return self._detect_graph(frames)
+
+        if self._net is not None:
+            return self._detect_torch(frames)
+
         if self.model is None:
-            return self._generate_demo_keypoints(frame.shape), 0.5
+            return [(self._generate_demo_keypoints(frame.shape), 0.5) for frame in frames]
 
         try:
             # Run inference
-            results = self.model(frame, verbose=False)
+            results = self.model(frames, verbose=False, device=self.device)
+            return [self._pose_from_result(result, frame.shape) for result, frame in zip(results, frames)]
+
+        except Exception as e:
+            logger.error(f"Pose detection failed: {e}")
+            return [(None, 0.0)] * len(frames)
 
-            if len(results) == 0 or results[0].keypoints is None:
-                return None, 0.0
+    def _pose_from_result(self, result, shape: Tuple) -> Tuple[Optional[np.ndarray], float]:
+        """Extract the first detected pose from an ultralytics result."""
+        if result.keypoints is None:
+            return None, 0.0
 
-            # Get keypoints from first detection
-            keypoints_data = results[0].keypoints
+        # Get keypoints from first detection
+        keypoints_data = result.keypoints
 
-            if keypoints_data.xy is None or len(keypoints_data.xy) == 0:
-                return None, 0.0
+        if keypoints_data.xy is None or len(keypoints_data.xy) == 0:
+            return None, 0.0
 
-            # Get first detected person/animal
+        # Get first detected person/animal, copying xy and confidence to host in one transfer
+        if keypoints_data.conf is not None:
+            pose = torch.cat([keypoints_data.xy[0], keypoints_data.conf[0].unsqueeze(-1)], dim=-1).cpu().numpy()
+            kpts, conf = pose[:, :2], pose[:, 2]
+        else:
             kpts = keypoints_data.xy[0].cpu().numpy()
-            conf = keypoints_data.conf[0].cpu().numpy() if keypoints_data.conf is not None else np.ones(len(kpts))
+            conf = np.ones(len(kpts))
 
-            # Map to our keypoint format
-            # Note: Standard YOLO pose has 17 keypoints, we extend to 24 for dogs
-            keypoints = self._map_keypoints(kpts, conf, frame.shape)
+        # Map to our keypoint format
+        # Note: Standard YOLO pose has 17 keypoints, we extend to 24 for dogs
+        keypoints = self._map_keypoints(kpts, conf, shape)
 
-            avg_confidence = float(np.mean(conf))
+        avg_confidence = float(np.mean(conf))
 
-            return keypoints, avg_confidence
+        return keypoints, avg_confidence
 
-        except Exception as e:
-            logger.error(f"Pose detection failed: {e}")
+    def _pose_from_output(self, output: np.ndarray, scale: float, pad: Tuple[int, int],
+                          shape: Tuple) -> Tuple[Optional[np.ndarray], float]:
+        """Map the best pose in a raw (1, 56, N) network output to our keypoint format.
+
+        Only the top-scoring candidate is used, which is what NMS would rank first,
+        so no NMS is run.
+        """
+        preds = output[0]
+        return self._pose_from_candidate(preds[:, int(np.argmax(preds[4]))], scale, pad, shape)
+
+    def _pose_from_candidate(self, candidate: np.ndarray, scale: float, pad: Tuple[int, int],
+                             shape: Tuple) -> Tuple[Optional[np.ndarray], float]:
+        """Map a single (56,) pose candidate to our keypoint format."""
+        pose = decode_pose_candidate(candidate, scale, pad, shape)
+        if pose is None:
             return None, 0.0
+        kpts, conf = pose
+        return self._map_keypoints(kpts, conf, shape), float(np.mean(conf))
 
-    def _map_keypoints(self, kpts: np.ndarray, conf: np.ndarray, shape: Tuple) -> Dict:
-        """Map YOLO keypoints to our dog keypoint format."""
-        h, w = shape[:2]
+    @staticmethod
+    def _best_candidates(output: torch.Tensor) -> np.ndarray:
+        """Pick each frame's top-scoring candidate on the device and copy them to host at once.
 
-        # Standard YOLO pose has 17 keypoints for humans
-        # We need to adapt/estimate for dogs (24 keypoints)
-
-        keypoints = {}
-
-        # Map available keypoints
-        yolo_names = [
-            'nose', 'left_eye', 'right_eye', 'left_ear', 'right_ear',
-            'left_shoulder', 'right_shoulder', 'left_elbow', 'right_elbow',
-            'left_wrist', 'right_wrist', 'left_hip', 'right_hip',
-            'left_knee', 'right_knee', 'left_ankle', 'right_ankle'
-        ]
-
-        for i, name in enumerate(yolo_names):
-            if i < len(kpts):
-                keypoints[name] = {
-                    'x': float(kpts[i][0]),
-                    'y': float(kpts[i][1]),
-                    'confidence': float(conf[i]) if i < len(conf) else 0.5
-                }
-            else:
-                keypoints[name] = {'x': 0, 'y': 0, 'confidence': 0}
-
-        # Estimate additional dog keypoints
-        # Tail points (estimate from hip positions)
-        if keypoints['left_hip']['confidence'] > 0.3 and keypoints['right_hip']['confidence'] > 0.3:
-            hip_center_x = (keypoints['left_hip']['x'] + keypoints['right_hip']['x']) / 2
-            hip_center_y = (keypoints['left_hip']['y'] + keypoints['right_hip']['y']) / 2
-
-            # Tail extends behind the body
-            keypoints['tail_base'] = {'x': hip_center_x, 'y': hip_center_y, 'confidence': 0.5}
-            keypoints['tail_mid'] = {'x': hip_center_x - 30, 'y': hip_center_y - 10, 'confidence': 0.4}
-            keypoints['tail_tip'] = {'x': hip_center_x - 60, 'y': hip_center_y - 20, 'confidence': 0.3}
-        else:
-            keypoints['tail_base'] = {'x': 0, 'y': 0, 'confidence': 0}
-            keypoints['tail_mid'] = {'x': 0, 'y': 0, 'confidence': 0}
-            keypoints['tail_tip'] = {'x': 0, 'y': 0, 'confidence': 0}
-
-        # Paw points (offset from ankle/wrist)
-        paw_offset = 15
-        for side in ['left', 'right']:
-            # Front paws
-            wrist = keypoints[f'{side}_wrist']
-            if wrist['confidence'] > 0.3:
-                keypoints[f'{side}_front_paw'] = {
-                    'x': wrist['x'],
-                    'y': wrist['y'] + paw_offset,
-                    'confidence': wrist['confidence'] * 0.8
-                }
-            else:
-                keypoints[f'{side}_front_paw'] = {'x': 0, 'y': 0, 'confidence': 0}
-
-            # Back paws
-            ankle = keypoints[f'{side}_ankle']
-            if ankle['confidence'] > 0.3:
-                keypoints[f'{side}_back_paw'] = {
-                    'x': ankle['x'],
-                    'y': ankle['y'] + paw_offset,
-                    'confidence': ankle['confidence'] * 0.8
-                }
+        Turns a (B, 56, N) output into a (B, 56) array, so only 56 values per frame cross
+        the device-to-host boundary in a single synchronizing copy.
+        """
+        best = output[:, 4].argmax(dim=1)
+        return output[torch.arange(len(output), device=output.device), :, best].cpu().numpy()
+
+    def _detect_onnx(self, frames: List[np.ndarray]) -> List[Tuple[Optional[np.ndarray], float]]:
+        """Run pose detection through ONNX Runtime."""
+        try:
+            if self._blob is None or len(self._blob) < len(frames):
+                self._blob = np.empty((len(frames), 3, INPUT_SIZE, INPUT_SIZE), dtype=np.float32)
+            blob = self._blob[:len(frames)]
+            geometry = [preprocess(frame, out=blob[i:i + 1])[1:] for i, frame in enumerate(frames)]
+
+            if self._dynamic_batch:
+                outputs = self.session.run(None, {self._input_name: blob})[0]
             else:
-                keypoints[f'{side}_back_paw'] = {'x': 0, 'y': 0, 'confidence': 0}
+                # Model exported with a fixed batch of 1
+                outputs = np.concatenate([self.session.run(None, {self._input_name: blob[i:i + 1]})[0]
+                                          for i in range(len(frames))])
+
+            return [self._pose_from_output(output[None], scale, pad, frame.shape)
+                    for output, (scale, pad), frame in zip(outputs, geometry, frames)]
+
+        except Exception as e:
+            logger.error(f"Pose detection failed: {e}")
+            return [(None, 0.0)] * len(frames)
+
+    def _detect_graph(self, frames: List[np.ndarray]) -> List[Tuple[Optional[np.ndarray], float]]:
+        """Run pose detection by replaying the captured CUDA graph, one frame at a time."""
+        try:
+            host = self._input_tensor(1)
+            host_np = host.numpy()
+            results = []
+            for frame in frames:
+                _, scale, pad = preprocess(frame, out=host_np)
+                # Same stream as the replay, so the copy is ordered before it
+                self._graph_in.copy_(host, non_blocking=True)
+                self._graph.replay()
+                candidate = self._best_candidates(self._graph_out)[0]
+                results.append(self._pose_from_candidate(candidate, scale, pad, frame.shape))
+            return results
+
+        except Exception as e:
+            logger.error(f"Pose detection failed: {e}")
+            return [(None, 0.0)] * len(frames)
+
+    def _detect_torch(self, frames: List[np.ndarray]) -> List[Tuple[Optional[np.ndarray], float]]:
+        """Run pose detection through the fused torch network on a reused input tensor."""
+        try:
+            host = self._input_tensor(len(frames))
+            host_np = host.numpy()
+            geometry = [preprocess(frame, out=host_np[i:i + 1])[1:] for i, frame in enumerate(frames)]
+
+            with torch.no_grad():
+                output = self._net(host.to(self.device, non_blocking=True))
+            output = output[0] if isinstance(output, (tuple, list)) else output
+            candidates = self._best_candidates(output)
+
+            return [self._pose_from_candidate(candidate, scale, pad, frame.shape)
+                    for candidate, (scale, pad), frame in zip(candidates, geometry, frames)]
+
+        except Exception as e:
+            logger.error(f"Pose detection failed: {e}")
+            return [(None, 0.0)] * len(frames)
+
+    def _map_keypoints(self, kpts: np.ndarray, conf: np.ndarray, shape: Tuple) -> np.ndarray:
+        """Map YOLO keypoints to our dog keypoint format.
+
+        Returns a (24, 3) float64 array of x, y, confidence in KEYPOINT_NAMES order
+        (float64 so the 0.3 visibility thresholds compare exactly as on Python floats).
+        """
+        # Standard YOLO pose has 17 keypoints for humans: scatter them into place by
+        # precomputed index; the other 7 dog keypoints are estimated
+        keypoints = np.zeros((len(KEYPOINT_NAMES), 3), dtype=np.float64)
+        rows = YOLO_TO_KEYPOINT[:len(kpts)]
+        keypoints[rows, :2] = kpts[:len(rows)]
+        keypoints[rows, 2] = conf[:len(rows)]
+
+        # Tail points (estimate from hip positions): the tail extends behind the body
+        if keypoints[L_HIP, 2] > 0.3 and keypoints[R_HIP, 2] > 0.3:
+            hip_center = (keypoints[L_HIP, :2] + keypoints[R_HIP, :2]) / 2
+            keypoints[TAIL, :2] = hip_center + TAIL_OFFSETS
+            keypoints[TAIL, 2] = TAIL_CONFIDENCE
+
+        # Paw points (offset below wrist/ankle)
+        limbs = keypoints[PAW_SOURCES]
+        visible = limbs[:, 2] > 0.3
+        paws = limbs * (1.0, 1.0, 0.8) + (0.0, PAW_OFFSET, 0.0)
+        keypoints[PAWS] = np.where(visible[:, None], paws, 0.0)
 
         return keypoints
 
-    def _generate_demo_keypoints(self, shape: Tuple) -> Dict:
+    def _generate_demo_keypoints(self, shape: Tuple) -> np.ndarray:
         """Generate demo keypoints for testing without model."""
-        import random
         h, w = shape[:2]
 
-        # Generate a walking dog pose centered in frame
-        center_x = w / 2
-        center_y = h / 2
-
-        keypoints = {}
-        for name in KEYPOINT_NAMES:
-            # Add some variation
-            offset_x = random.uniform(-100, 100)
-            offset_y = random.uniform(-50, 50)
-            keypoints[name] = {
-                'x': center_x + offset_x,
-                'y': center_y + offset_y,
-                'confidence': random.uniform(0.6, 0.95)
-            }
-
+        # Generate a walking dog pose centered in frame, with some variation:
+        # x offset, y offset and confidence drawn for all keypoints at once
+        keypoints = _demo_rng.uniform(DEMO_LOW, DEMO_HIGH, (len(KEYPOINT_NAMES), 3))
+        keypoints[:, 0] += w / 2
+        keypoints[:, 1] += h / 2
         return keypoints
 
 
 # Singleton instance
 _detector: Optional[PoseDetector] = None
+_detector_lock = threading.Lock()
 
 
 def get_detector() -> PoseDetector:
     """Get or create the pose detector singleton."""
     global _detector
     if _detector is None:
-        _detector = PoseDetector()
+        with _detector_lock:
+            if _detector is None:
+                _detector = PoseDetector(device=POSE_DEVICE)
     return _detector
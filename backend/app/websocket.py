@@ -1,16 +1,34 @@
-import json
 import logging
+import orjson
+import xxhash
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import WebSocket, WebSocketDisconnect
-from typing import Dict, Set, Optional
+from typing import Dict, Set, Optional, Tuple
 import asyncio
+import numpy as np
 
 from .pose_detector import get_detector
 from .metrics import MetricsCalculator
 from .color_detector import ColorMarkerDetector, DEFAULT_MARKER_CONFIGS
-from .models import DetectionMode, ColorMarkerConfig, HSVRange
+from .models import (
+    DetectionMode, ColorMarkerConfig, HSVRange, FrameData, keypoints_to_dict, RESULT_HEADER, RESULT_TAG,
+)
 
 logger = logging.getLogger(__name__)
 
+# Frames buffered between pipeline stages per connection
+PIPELINE_DEPTH = 2
+
+# Pose inference runs on one thread: the YOLO predictor is not thread-safe and the
+# detector reuses its input buffers. Torch and ONNX Runtime parallelize each forward
+# pass internally, so more workers would only contend for the same cores.
+_inference_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pose')
+
+# Cross-connection pose batching: how long (s) to wait for other clients' frames,
+# and the most frames run in one forward pass
+POSE_BATCH_WINDOW = 0.005
+MAX_POSE_BATCH = 8
+
 
 class ConnectionManager:
     """Manage WebSocket connections."""
@@ -20,6 +38,8 @@ class ConnectionManager:
         self.metrics_calculators: Dict[WebSocket, MetricsCalculator] = {}
         self.detection_modes: Dict[WebSocket, str] = {}
         self.color_detectors: Dict[WebSocket, ColorMarkerDetector] = {}
+        self._pose_queue: Optional[asyncio.Queue] = None
+        self._pose_task: Optional[asyncio.Task] = None
 
     async def connect(self, websocket: WebSocket):
         """Accept new connection."""
@@ -43,33 +63,79 @@ class ConnectionManager:
             self.metrics_calculators[websocket] = MetricsCalculator()
         return self.metrics_calculators[websocket]
 
+    async def detect_pose(self, frame: np.ndarray) -> Tuple[Optional[np.ndarray], float]:
+        """Queue a frame for batched pose inference and wait for its result."""
+        if self._pose_task is None:
+            self._pose_queue = asyncio.Queue()
+            self._pose_task = asyncio.create_task(self._pose_batch_worker())
+        future = asyncio.get_running_loop().create_future()
+        await self._pose_queue.put((frame, future))
+        return await future
+
+    async def _pose_batch_worker(self):
+        """Run queued frames from all connections through the pose model in batches."""
+        loop = asyncio.get_running_loop()
+        detector = get_detector()
+        while True:
+            batch = [await self._pose_queue.get()]
+            # Frames that queued up during the previous forward pass join right away;
+            # with other clients connected, wait briefly for their next frames too
+            window = POSE_BATCH_WINDOW if len(self.active_connections) > 1 else 0.0
+            deadline = loop.time() + window
+            while len(batch) < MAX_POSE_BATCH:
+                if not self._pose_queue.empty():
+                    batch.append(self._pose_queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._pose_queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                results = await loop.run_in_executor(
+                    _inference_executor, detector.detect_batch, [frame for frame, _ in batch])
+            except Exception as e:
+                logger.error(f"Batched pose detection failed: {e}")
+                results = [(None, 0.0)] * len(batch)
+
+            for (_, future), result in zip(batch, results):
+                # Skip frames whose connection closed while waiting
+                if not future.done():
+                    future.set_result(result)
+
     async def send_result(self, websocket: WebSocket, result: dict):
         """Send analysis result to client."""
+        await self.send_json(websocket, 'result', result)
+
+    async def send_pose_result(self, websocket: WebSocket, timestamp: int, keypoints: np.ndarray,
+                               confidence: float, metrics: dict):
+        """Send a pose result as one fixed-layout binary message (see RESULT_HEADER).
+
+        Keypoints go out as raw float32 instead of 24 named JSON objects.
+        """
         try:
-            await websocket.send_json({
-                'type': 'result',
-                'data': result
-            })
+            await websocket.send_bytes(
+                RESULT_HEADER.pack(RESULT_TAG, timestamp, confidence)
+                + keypoints.astype('<f4').tobytes()
+                + orjson.dumps(metrics, option=orjson.OPT_SERIALIZE_NUMPY)
+            )
         except Exception as e:
             logger.error(f"Failed to send result: {e}")
 
     async def send_error(self, websocket: WebSocket, error: str):
         """Send error message to client."""
-        try:
-            await websocket.send_json({
-                'type': 'error',
-                'data': error
-            })
-        except Exception as e:
-            logger.error(f"Failed to send error: {e}")
+        await self.send_json(websocket, 'error', error)
 
-    async def send_json(self, websocket: WebSocket, msg_type: str, data: dict):
-        """Send a typed JSON message to client."""
+    async def send_json(self, websocket: WebSocket, msg_type: str, data):
+        """Send a typed JSON message to client as an orjson-encoded binary frame."""
         try:
-            await websocket.send_json({
+            await websocket.send_bytes(orjson.dumps({
                 'type': msg_type,
                 'data': data
-            })
+            }, option=orjson.OPT_SERIALIZE_NUMPY))
         except Exception as e:
             logger.error(f"Failed to send {msg_type}: {e}")
 
@@ -78,20 +144,150 @@ class ConnectionManager:
 manager = ConnectionManager()
 
 
+class FramePipeline:
+    """Per-connection decode -> detect -> metrics pipeline.
+
+    Each stage is its own task joined by bounded queues, so decoding frame N+1
+    overlaps detection of frame N. Decoding and detection run in worker threads
+    (OpenCV and torch release the GIL); metrics and sending stay on the event loop.
+    Every stage is FIFO, so results are sent in the order frames arrived.
+
+    A frame whose encoded bytes are identical to the previous frame's (a client
+    re-sending under backpressure, a static scene) skips decoding and detection and
+    reuses the previous detection; metrics still run with the new timestamp.
+    """
+
+    def __init__(self, websocket: WebSocket, calculator: MetricsCalculator):
+        self.websocket = websocket
+        self.calculator = calculator
+        self.detector = get_detector()
+        self._decode_queue: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_DEPTH)
+        self._detect_queue: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_DEPTH)
+        self._metrics_queue: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_DEPTH)
+        self._tasks = [
+            asyncio.create_task(self._decode_worker()),
+            asyncio.create_task(self._detect_worker()),
+            asyncio.create_task(self._metrics_worker()),
+        ]
+        # Repeated-frame detection: (hash, mode, generation) of the last frame decoded,
+        # and the detection result it produced
+        self._last_key: Optional[Tuple] = None
+        self._generation = 0
+        self._last_detection: Tuple = (None, 0.0, None)
+
+    async def submit(self, frame_msg: FrameData, mode: str):
+        """Queue a frame for analysis, waiting while the pipeline is full."""
+        await self._decode_queue.put((frame_msg.timestamp, mode, frame_msg.data))
+
+    def invalidate(self):
+        """Stop reusing the last detection, e.g. after the detector's settings changed."""
+        self._generation += 1
+
+    async def close(self):
+        """Stop all stages, dropping frames still in flight."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _decode_worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            timestamp, mode, frame_data = await self._decode_queue.get()
+            key = (xxhash.xxh3_64_intdigest(frame_data), mode, self._generation)
+            repeated = key == self._last_key
+            self._last_key = key
+            frame = None if repeated else await loop.run_in_executor(
+                None, self.detector.decode_frame, frame_data)
+            await self._detect_queue.put((timestamp, mode, frame, repeated))
+
+    async def _detect_worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            timestamp, mode, frame, repeated = await self._detect_queue.get()
+            if repeated:
+                # Same bytes as the frame just before it in this FIFO
+                await self._metrics_queue.put((timestamp, mode, *self._last_detection))
+                continue
+
+            keypoints, confidence, error = None, 0.0, None
+            try:
+                if frame is None:
+                    error = 'Failed to decode frame'
+                elif mode == DetectionMode.COLOR_MARKER:
+                    color_det = manager.color_detectors.get(self.websocket)
+                    if color_det:
+                        keypoints, confidence = await loop.run_in_executor(None, color_det.detect, frame)
+                else:
+                    keypoints, confidence = await manager.detect_pose(frame)
+            except Exception as e:
+                logger.error(f"Error processing frame: {e}")
+                error = str(e)
+            self._last_detection = (keypoints, confidence, error)
+            await self._metrics_queue.put((timestamp, mode, keypoints, confidence, error))
+
+    async def _metrics_worker(self):
+        while True:
+            timestamp, mode, keypoints, confidence, error = await self._metrics_queue.get()
+            try:
+                if error is not None:
+                    await manager.send_error(self.websocket, error)
+                    continue
+
+                if keypoints is None:
+                    await manager.send_result(self.websocket, {
+                        'timestamp': timestamp,
+                        'keypoints': None,
+                        'joint_angles': None,
+                        'gait_metrics': None,
+                        'confidence': 0.0
+                    })
+                    continue
+
+                # Calculate metrics with detection mode
+                metrics = self.calculator.calculate_gait_metrics(keypoints, timestamp, mode)
+
+                # Pose keypoints stay a (24, 3) array all the way to the wire
+                if isinstance(keypoints, np.ndarray):
+                    await manager.send_pose_result(self.websocket, timestamp, keypoints, confidence, metrics)
+                    continue
+
+                result = {
+                    'timestamp': timestamp,
+                    'keypoints': keypoints,
+                    'joint_angles': metrics['joint_angles'],
+                    'gait_metrics': metrics['gait_metrics'],
+                    'confidence': confidence
+                }
+
+                await manager.send_result(self.websocket, result)
+            except Exception as e:
+                logger.error(f"Error processing frame: {e}")
+                await manager.send_error(self.websocket, str(e))
+
+
 async def handle_websocket(websocket: WebSocket):
     """Handle WebSocket connection for frame analysis."""
     await manager.connect(websocket)
     detector = get_detector()
     calculator = manager.get_calculator(websocket)
+    pipeline = FramePipeline(websocket, calculator)
 
     try:
         while True:
-            # Receive frame data
-            data = await websocket.receive_text()
+            received = await websocket.receive()
+            if received['type'] == 'websocket.disconnect':
+                raise WebSocketDisconnect(received.get('code', 1000))
 
             try:
-                message = json.loads(data)
-                msg_type = message.get('type', '')
+                if received.get('bytes') is not None:
+                    # Binary frame: fixed header + raw image bytes, no JSON or base64
+                    frame_msg = FrameData.from_binary(received['bytes'])
+                    message = {}
+                    msg_type = frame_msg.type
+                else:
+                    frame_msg = None
+                    message = orjson.loads(received['text'])
+                    msg_type = message.get('type', '')
 
                 if msg_type == 'set_mode':
                     # Set detection mode for this connection
@@ -101,6 +297,7 @@ async def handle_websocket(websocket: WebSocket):
                         if websocket not in manager.color_detectors:
                             manager.color_detectors[websocket] = ColorMarkerDetector()
                     calculator.reset()
+                    pipeline.invalidate()
                     await manager.send_json(websocket, 'mode_set', {'mode': mode})
 
                 elif msg_type == 'update_marker_config':
@@ -119,14 +316,17 @@ async def handle_websocket(websocket: WebSocket):
                         manager.color_detectors[websocket] = ColorMarkerDetector(configs)
                     else:
                         manager.color_detectors[websocket].update_configs(configs)
+                    pipeline.invalidate()
                     await manager.send_json(websocket, 'marker_config_updated', {'count': len(configs)})
 
                 elif msg_type == 'calibrate_frame':
                     # Process frame in calibration mode
-                    frame_data = message.get('data', '')
+                    frame_msg = frame_msg or FrameData.from_message(message)
                     mode = manager.detection_modes.get(websocket, DetectionMode.AI_POSE)
 
-                    frame = detector.decode_frame(frame_data)
+                    # Decoding and detection run off the event loop, like pipeline frames
+                    loop = asyncio.get_running_loop()
+                    frame = await loop.run_in_executor(None, detector.decode_frame, frame_msg.data)
                     if frame is None:
                         await manager.send_error(websocket, 'Failed to decode calibration frame')
                         continue
@@ -136,22 +336,21 @@ async def handle_websocket(websocket: WebSocket):
                         if not color_det:
                             color_det = ColorMarkerDetector()
                             manager.color_detectors[websocket] = color_det
-                        detected_points = color_det.detect_all_colors(frame)
+                        detected_points = await loop.run_in_executor(None, color_det.detect_all_colors, frame)
                     else:
                         # AI pose mode calibration: run YOLO and return keypoints as detected points
-                        keypoints, confidence = detector.detect(frame)
+                        keypoints, confidence = await manager.detect_pose(frame)
                         detected_points = []
-                        if keypoints:
-                            for joint_name, kp in keypoints.items():
-                                if kp['confidence'] > 0.3:
-                                    detected_points.append({
-                                        'id': f"ai_{joint_name}",
-                                        'x': kp['x'],
-                                        'y': kp['y'],
-                                        'suggested_label': joint_name,
-                                        'color_name': None,
-                                        'confidence': kp['confidence'],
-                                    })
+                        if keypoints is not None:
+                            for joint_name, kp in keypoints_to_dict(keypoints, min_confidence=0.3).items():
+                                detected_points.append({
+                                    'id': f"ai_{joint_name}",
+                                    'x': kp['x'],
+                                    'y': kp['y'],
+                                    'suggested_label': joint_name,
+                                    'color_name': None,
+                                    'confidence': kp['confidence'],
+                                })
 
                     await manager.send_json(websocket, 'calibration_result', {
                         'detected_points': detected_points
@@ -168,53 +367,15 @@ async def handle_websocket(websocket: WebSocket):
                             color_det.set_label_mapping(label_mapping)
 
                     calculator.reset()
+                    pipeline.invalidate()
                     await manager.send_json(websocket, 'calibration_confirmed', {'success': True})
 
                 elif msg_type == 'frame':
-                    # Normal frame processing
-                    frame_data = message.get('data', '')
-                    timestamp = message.get('timestamp', 0)
-
-                    frame = detector.decode_frame(frame_data)
-                    if frame is None:
-                        await manager.send_error(websocket, 'Failed to decode frame')
-                        continue
-
+                    # Normal frame processing: hand off to the pipeline
                     mode = manager.detection_modes.get(websocket, DetectionMode.AI_POSE)
+                    await pipeline.submit(frame_msg or FrameData.from_message(message), mode)
 
-                    if mode == DetectionMode.COLOR_MARKER:
-                        color_det = manager.color_detectors.get(websocket)
-                        if color_det:
-                            keypoints, confidence = color_det.detect(frame)
-                        else:
-                            keypoints, confidence = None, 0.0
-                    else:
-                        keypoints, confidence = detector.detect(frame)
-
-                    if keypoints is None:
-                        await manager.send_result(websocket, {
-                            'timestamp': timestamp,
-                            'keypoints': None,
-                            'joint_angles': None,
-                            'gait_metrics': None,
-                            'confidence': 0.0
-                        })
-                        continue
-
-                    # Calculate metrics with detection mode
-                    metrics = calculator.calculate_gait_metrics(keypoints, timestamp, mode)
-
-                    result = {
-                        'timestamp': timestamp,
-                        'keypoints': keypoints,
-                        'joint_angles': metrics['joint_angles'],
-                        'gait_metrics': metrics['gait_metrics'],
-                        'confidence': confidence
-                    }
-
-                    await manager.send_result(websocket, result)
-
-            except json.JSONDecodeError:
+            except orjson.JSONDecodeError:
                 await manager.send_error(websocket, 'Invalid JSON')
             except Exception as e:
                 logger.error(f"Error processing frame: {e}")
@@ -225,3 +386,5 @@ async def handle_websocket(websocket: WebSocket):
     except Exception as e:
         logger.error(f"WebSocket error: {e}")
         manager.disconnect(websocket)
+    finally:
+        await pipeline.close()
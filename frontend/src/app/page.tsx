@@ -15,6 +15,7 @@ import {
   DetectedPoint,
   ColorMarkerConfig,
   DEFAULT_MARKER_CONFIGS,
+  FramePayload,
 } from '@/lib/types'
 import { createSession, endSession, getSessionHistory, deleteSession, getSessionResults } from '@/lib/supabase'
 
@@ -134,7 +135,7 @@ export default function Dashboard() {
   }, [dogId])
 
   // Handle frame for analysis (in dashboard)
-  const handleFrame = useCallback((frame: string) => {
+  const handleFrame = useCallback((frame: FramePayload) => {
     if (isConnected) {
       sendFrame(frame)
     }
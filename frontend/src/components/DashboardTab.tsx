@@ -13,6 +13,7 @@ import {
   TrajectoryPoint,
   Session,
   DetectionMode,
+  FramePayload,
 } from '@/lib/types'
 
 interface DashboardTabProps {
@@ -36,7 +37,7 @@ interface DashboardTabProps {
   sessions: Session[]
 
   // Actions
-  onFrame: (frame: string) => void
+  onFrame: (frame: FramePayload) => void
   onStartSession: () => void
   onEndSession: () => void
   onLoadSession: (session: Session) => void
@@ -2,10 +2,10 @@
 
 import { useEffect, useRef, useCallback, useState } from 'react'
 import { useCamera } from '@/hooks/useCamera'
-import { DogKeypoints, DetectionMode } from '@/lib/types'
+import { DogKeypoints, DetectionMode, FramePayload } from '@/lib/types'
 
 interface VideoStreamProps {
-  onFrame?: (frame: string) => void
+  onFrame?: (frame: FramePayload) => void
   keypoints?: DogKeypoints | null
   isAnalyzing: boolean
   detectionMode?: DetectionMode
@@ -84,8 +84,8 @@ export function useCamera({
     setIsStreaming(false)
   }, [])
 
-  // Capture single frame as base64
-  const captureFrame = useCallback((): string | null => {
+  // Draw the current video frame onto the capture canvas
+  const drawFrame = useCallback((): HTMLCanvasElement | null => {
     if (!videoRef.current || !canvasRef.current) return null
     if (!isStreaming) return null
 
@@ -98,25 +98,32 @@ export function useCamera({
     canvas.width = video.videoWidth || width
     canvas.height = video.videoHeight || height
     ctx.drawImage(video, 0, 0, canvas.width, canvas.height)
+    return canvas
+  }, [isStreaming, width, height])
 
+  // Capture single frame as base64
+  const captureFrame = useCallback((): string | null => {
+    const canvas = drawFrame()
     // Return base64 encoded JPEG (smaller than PNG)
-    return canvas.toDataURL('image/jpeg', 0.7)
-  }, [isStreaming, width, height])
+    return canvas ? canvas.toDataURL('image/jpeg', 0.7) : null
+  }, [drawFrame])
 
   // Start continuous frame capture
-  const startCapture = useCallback((onFrame: (frame: string) => void) => {
+  const startCapture = useCallback((onFrame: (frame: Blob) => void) => {
     if (intervalRef.current) {
       clearInterval(intervalRef.current)
     }
 
     const interval = 1000 / fps
     intervalRef.current = setInterval(() => {
-      const frame = captureFrame()
-      if (frame) {
-        onFrame(frame)
-      }
+      // Encode to JPEG bytes: sent as-is in a binary message, no base64
+      drawFrame()?.toBlob((blob) => {
+        if (blob) {
+          onFrame(blob)
+        }
+      }, 'image/jpeg', 0.7)
     }, interval)
-  }, [fps, captureFrame])
+  }, [fps, drawFrame])
 
   // Stop continuous frame capture
   const stopCapture = useCallback(() => {
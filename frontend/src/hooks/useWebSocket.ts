@@ -1,7 +1,47 @@
 'use client'
 
 import { useState, useCallback, useRef, useEffect } from 'react'
-import { ConnectionStatus, AnalysisResult, DetectionMode, DetectedPoint, ColorMarkerConfig } from '@/lib/types'
+import {
+  ConnectionStatus, AnalysisResult, DetectionMode, DetectedPoint, ColorMarkerConfig, FramePayload,
+  DogKeypoints, KEYPOINT_NAMES,
+} from '@/lib/types'
+
+const textDecoder = new TextDecoder()
+
+// Binary frame message kinds, matching BINARY_FRAME_TYPES on the backend
+const BINARY_FRAME = 0
+const BINARY_CALIBRATE_FRAME = 1
+
+// Binary pose result: 'K' tag, pad, timestamp (f64), confidence (f32), pad,
+// then 24 x (x, y, confidence) f32 keypoints, then JSON {joint_angles, gait_metrics}
+const POSE_RESULT_TAG = 0x4b
+const POSE_RESULT_HEADER = 24
+const POSE_RESULT_JSON = POSE_RESULT_HEADER + KEYPOINT_NAMES.length * 3 * 4
+
+function parsePoseResult(buffer: ArrayBuffer): AnalysisResult {
+  const header = new DataView(buffer, 0, POSE_RESULT_HEADER)
+  const values = new Float32Array(buffer, POSE_RESULT_HEADER, KEYPOINT_NAMES.length * 3)
+  const keypoints = {} as DogKeypoints
+  KEYPOINT_NAMES.forEach((name, i) => {
+    keypoints[name] = { x: values[i * 3], y: values[i * 3 + 1], confidence: values[i * 3 + 2] }
+  })
+  const metrics = JSON.parse(textDecoder.decode(new Uint8Array(buffer, POSE_RESULT_JSON)))
+  return {
+    timestamp: header.getFloat64(8, true),
+    keypoints,
+    joint_angles: metrics.joint_angles,
+    gait_metrics: metrics.gait_metrics,
+    confidence: header.getFloat32(16, true),
+  }
+}
+
+// 16-byte header for binary frame messages: kind (u8), 7 pad bytes, timestamp ms (f64 LE)
+function binaryFrame(kind: number, timestamp: number, image: Blob): Blob {
+  const header = new DataView(new ArrayBuffer(16))
+  header.setUint8(0, kind)
+  header.setFloat64(8, timestamp, true)
+  return new Blob([header.buffer, image])
+}
 
 interface UseWebSocketOptions {
   url: string
@@ -39,6 +79,7 @@ export function useWebSocket({
 
     try {
       const ws = new WebSocket(url)
+      ws.binaryType = 'arraybuffer'
       wsRef.current = ws
 
       ws.onopen = () => {
@@ -61,7 +102,20 @@ export function useWebSocket({
 
       ws.onmessage = (event) => {
         try {
-          const message = JSON.parse(event.data)
+          if (event.data instanceof ArrayBuffer && new Uint8Array(event.data, 0, 1)[0] === POSE_RESULT_TAG) {
+            if (onResult) {
+              const now = Date.now()
+              if (lastSendTimeRef.current > 0) {
+                setLatency(now - lastSendTimeRef.current)
+              }
+              onResult(parsePoseResult(event.data))
+            }
+            return
+          }
+
+          // Server messages arrive as binary UTF-8 JSON; text is still accepted
+          const text = typeof event.data === 'string' ? event.data : textDecoder.decode(event.data)
+          const message = JSON.parse(text)
 
           switch (message.type) {
             case 'result':
@@ -125,9 +179,13 @@ export function useWebSocket({
     setStatus('disconnected')
   }, [])
 
-  const sendFrame = useCallback((frameData: string) => {
+  const sendFrame = useCallback((frameData: FramePayload) => {
     if (wsRef.current?.readyState === WebSocket.OPEN) {
       lastSendTimeRef.current = Date.now()
+      if (frameData instanceof Blob) {
+        wsRef.current.send(binaryFrame(BINARY_FRAME, lastSendTimeRef.current, frameData))
+        return
+      }
       wsRef.current.send(JSON.stringify({
         type: 'frame',
         data: frameData,
@@ -146,8 +204,12 @@ export function useWebSocket({
     }
   }, [])
 
-  const sendCalibrationFrame = useCallback((frameData: string) => {
+  const sendCalibrationFrame = useCallback((frameData: FramePayload) => {
     if (wsRef.current?.readyState === WebSocket.OPEN) {
+      if (frameData instanceof Blob) {
+        wsRef.current.send(binaryFrame(BINARY_CALIBRATE_FRAME, Date.now(), frameData))
+        return
+      }
       wsRef.current.send(JSON.stringify({
         type: 'calibrate_frame',
         data: frameData,
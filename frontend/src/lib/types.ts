@@ -32,6 +32,16 @@ export interface DogKeypoints {
   right_back_paw: Keypoint
 }
 
+// Keypoint order of the backend's binary pose results (matches DogKeypoints)
+export const KEYPOINT_NAMES: (keyof DogKeypoints)[] = [
+  'nose', 'left_eye', 'right_eye', 'left_ear', 'right_ear',
+  'left_shoulder', 'right_shoulder', 'left_elbow', 'right_elbow',
+  'left_wrist', 'right_wrist', 'left_hip', 'right_hip',
+  'left_knee', 'right_knee', 'left_ankle', 'right_ankle',
+  'tail_base', 'tail_mid', 'tail_tip',
+  'left_front_paw', 'right_front_paw', 'left_back_paw', 'right_back_paw',
+]
+
 export interface JointAngles {
   left_shoulder: number
   right_shoulder: number
@@ -81,6 +91,9 @@ export interface WebSocketMessage {
 
 export type ConnectionStatus = 'disconnected' | 'connecting' | 'connected' | 'error'
 
+// Captured frame: base64 data URL, or JPEG bytes sent as a binary WebSocket message
+export type FramePayload = string | Blob
+
 // Detection mode
 export type DetectionMode = 'ai_pose' | 'color_marker'
 